@@ -1,227 +1,285 @@
-import csv
-import os   
-from helper import *
-import pandas as pd
+import os
+import logging
+from helper import (ECW_REPORTS, acquire_context, capture_statistic, change_report_format_and_download,
+                    comtec_stat_types, daily_call_date_range, download_dir, ecw_report_window,
+                    fast_export_enabled, login_with_session, persist_sessions, release_context,
+                    replay_report_export, retry_operation, save_failure_trace, select_options_by_label, span,
+                    traced, wait_for_download, wait_for_page_load, wait_for_ready)
+from run_state import file_digest, skip_unchanged_uploads, uploaded_digest, record_upload
+from sheets import write_rows_to_targets, sync_rows_to_targets, invalidate_sheet_cache
+from ingest import iter_rows
 
 
 # ===========================
 # ECW
 # ===========================
 
-def daily_pro_orders(page,browser,playwright):
-    try:
-        logging.info("Starting daily_pro_orders")
-        page.goto(os.getenv("ECW_URL"))
-        wait_for_page_load(page)
-        fill_with_delay(page, 'input#username', os.getenv("ECW_USERNAME"))
-        fill_with_delay(page, 'input#password', os.getenv("ECW_PASSWORD"))
-        page.get_by_role("button", name="Login").click()
-        logging.info("Logged in successfully")
-        page.get_by_role("link", name="Dashboard", exact=True).click()
-        page.get_by_role("link", name="Shortcut to Pro Orders with Ins RS", exact=True).click()
-        page.wait_for_load_state('networkidle',timeout=120000)
-        page.wait_for_selector('img[title="Run Report"]', timeout=60000)
-        retry_operation(page.get_by_label("Run Report").click)
-        wait_for_page_load(page,timeout=90000)
-        logging.info("Report run successfully")
+def fill_ecw_prompts(page, report, window=None):
+    """Answer a report's date, keyword and status prompts (see ECW_REPORTS) and finish it; the dates span `window`."""
+    date_range = report.get('date_range')
+    if date_range:
+        start, end = window
+        wait_for_ready(page, page.get_by_label("Date Selection"), timeout=90000)
         page.get_by_label("Date Selection").select_option("Custom Date", timeout=30000)
         page.get_by_label("Text box prompt").click(timeout=30000)
-        page.get_by_label("Text box prompt").fill("0", timeout=30000)               
-        page.locator("input[aria-label='Year entry text field']").first.wait_for(state="visible", timeout=30000)
-        page.locator("input[aria-label='Year entry text field']").first.evaluate("element => element.value = ''")  # Clear the field first
-        page.locator("input[aria-label='Year entry text field']").first.fill("2024", timeout=30000)
-        page.locator("input[aria-label='Year entry text field']").first.press("Enter")
-        page.wait_for_timeout(5000)
-        page.get_by_role("option", name="Jun", exact=True).first.click(timeout=30000)
-        page.get_by_role("option", name="1", exact=True).first.click(timeout=30000)
-        page.get_by_role("option", name=str(calculate_dates()[0]), exact=True).nth(1).click(timeout=30000)
-        page.get_by_role("option", name=str(calculate_dates()[1]), exact=True).nth(1).click(timeout=30000)
+        page.get_by_label("Text box prompt").fill(date_range['text_prompt'], timeout=30000)
+        year = page.locator("input[aria-label='Year entry text field']").first
+        year.wait_for(state="visible", timeout=30000)
+        year.evaluate("element => element.value = ''")  # Clear the field first
+        year.fill(str(start.year), timeout=30000)
+        year.press("Enter")
+        wait_for_ready(page, page.get_by_role("option", name=start.strftime('%b'), exact=True), timeout=30000)
+        page.get_by_role("option", name=start.strftime('%b'), exact=True).first.click(timeout=30000)
+        page.get_by_role("option", name=str(start.day), exact=True).first.click(timeout=30000)
+        page.get_by_role("option", name=end.strftime('%b'), exact=True).nth(1).click(timeout=30000)
+        page.get_by_role("option", name=str(end.day), exact=True).nth(1).click(timeout=30000)
         page.get_by_role("button", name="OK").click()
-        wait_for_page_load(page,timeout=90000)
         logging.info("Date selected successfully")
+    if report.get('keywords'):
+        wait_for_ready(page, page.get_by_label("Keywords:"), timeout=90000)
         page.get_by_label("Keywords:").first.click()
-        page.get_by_label("Keywords:").fill("ord")
+        page.get_by_label("Keywords:").fill(report['keywords'])
         page.get_by_role("button", name="Search").click()
         page.get_by_role("link", name="Select all", exact=True).nth(1).click()
         page.get_by_role("button", name="InsertAdd selected items to").click()
-        listbox = page.locator("select[multiple]").first
-        options = [
-            "", "*Auth Denied", "*Auth Submitted", "*Declined", "*Done", "*Duplicate",
-            "*Info updated", "*Lock Note", "*Missing Info", "*Peer to Peer",
-            "*Pending Auth", "*Pending Estimate", "*PT/Imaging Needed",
-            "*Ready to Schedule", "*Ready To Schedule BT", "*Ready To Schedule PC"
-        ]
-
-        for option in options:
-            try:
-                option_element = listbox.locator(f"option:has-text('{option}')").first
-                if option_element.is_visible():  # Check if the option is visible
-                    option_element.click(modifiers=['Control'])
-                    page.wait_for_timeout(100)
-                else:
-                    logging.info(f"Option '{option}' not found, skipping.")
-            except Exception as e:
-                logging.warning(f"Failed to select option '{option}': {str(e)}")
-
-        page.get_by_role("button", name="Finish").click()
-        wait_for_page_load(page,timeout=120000)
-        logging.info("Report finished successfully")
-        retry_operation(change_report_format_and_download, page=page, download_dir=download_dir, file_name='daily_pro_orders')
-        logging.info("Report downloaded successfully")
-        page.get_by_label("Log Off").click()
-        wait_for_page_load(page,timeout=120000)
-        page.close()
-        logging.info("daily_pro_orders completed successfully")
+    if report.get('statuses'):
+        select_options_by_label(page.locator("select[multiple]").first, report['statuses'])
+    page.get_by_role("button", name="Finish").click()
+
+def run_ecw_report(page, name):
+    """Run one ECW_REPORTS report on a logged-in ECW page and download it as <name>.csv."""
+    report = ECW_REPORTS[name]
+    with span('report', report=name):
+        logging.info(f"Starting {name}")
+        with span('navigation'):
+            page.get_by_role("link", name="Dashboard", exact=True).click()
+            page.get_by_role("link", name=report['link'], exact=True).click()
+            wait_for_ready(page, 'img[title="Run Report"]', timeout=120000)
+        with span('report_run'):
+            retry_operation(page.get_by_label("Run Report").click, policy='ui')
+            logging.info("Report run successfully")
+            if report.get('date_range') or report.get('keywords') or report.get('statuses'):
+                window = ecw_report_window(name) if report.get('date_range') else None
+                fill_ecw_prompts(page, report, window)
+            wait_for_ready(page, page.get_by_label("Change report format"), timeout=120000)
+            logging.info("Report finished successfully")
+        retry_operation(change_report_format_and_download, page=page, download_dir=download_dir, file_name=name, policy='download')
+        logging.info(f"{name} completed successfully")
+
+def _run_session_report(context, page, name, errors):
+    """Run one report of an ECW session, recording its error in `errors` instead of raising."""
+    try:
+        if ECW_REPORTS[name].get('fast_export') and fast_export_enabled() and replay_report_export(context, download_dir, name):
+            logging.info(f"{name} completed successfully via direct export")
+        else:
+            run_ecw_report(page, name)
+        errors[name] = None
     except Exception as e:
-        logging.error(f"Error in daily_pro_orders: {e}")
-    finally:
-        browser.close()
-        playwright.stop()
+        logging.error(f"Error in {name}: {e}")
+        if not any(errors.values()):
+            save_failure_trace(context, name)  # tracing stops at the first saved trace
+        errors[name] = str(e)
 
- 
- 
-def dme_orders(page,browser,playwright):
+@traced()
+def ecw_report_session(reports=None):
+    """
+    Log in to ECW once, run `reports` (ECW_REPORTS names) back to back and log off once.
+    A failed report is logged and does not stop the others; its download is simply missing.
+    Returns:
+        dict of report name -> error message, or None for reports that downloaded
+    """
+    reports = list(reports or ECW_REPORTS)
+    context = acquire_context(system='ECW')
+    page = context.new_page()
+    errors = {}
     try:
-        page.goto(os.getenv("ECW_URL"))
-        wait_for_page_load(page)
-        fill_with_delay(page, 'input#username', os.getenv("ECW_USERNAME"))
-        fill_with_delay(page, 'input#password', os.getenv("ECW_PASSWORD"))
-        logging.info("Logged in successfully")
-        page.get_by_role("button", name="Login").click()
-        page.get_by_role("link", name="Dashboard", exact=True).click()
-        page.get_by_role("link", name="Report View of 4.14 - Next Day Appointments", exact=True).click()
-        page.wait_for_load_state('networkidle',timeout=120000)
-        page.wait_for_selector('img[title="Run Report"]', timeout=60000)
-        retry_operation(page.get_by_label("Run Report").click)
-        wait_for_page_load(page,timeout=90000)
-        logging.info("Report run successfully")
-        retry_operation(change_report_format_and_download, page=page, download_dir=download_dir, file_name='dme_orders')
-        logging.info("Report downloaded successfully")
-        page.get_by_label("Log Off").click()
-        wait_for_page_load(page,timeout=120000)
+        logging.info(f"Starting ECW session for {', '.join(reports)}")
+        login_with_session(page, 'ECW')
+        for name in reports:
+            _run_session_report(context, page, name, errors)
+            if errors[name]:
+                login_with_session(page, 'ECW')  # back to a clean dashboard
+        if not persist_sessions():
+            page.get_by_label("Log Off").click()
+            wait_for_page_load(page, timeout=120000, state='domcontentloaded')
         page.close()
-        logging.info("dme_orders completed successfully")
+        logging.info(f"ECW session finished: {sum(error is None for error in errors.values())}/{len(reports)} reports downloaded")
     except Exception as e:
-        logging.error(f"Error in dme_orders: {e}")
+        logging.error(f"Error in ecw_report_session: {e}")
+        save_failure_trace(context, 'ecw_report_session')
+        errors.update({name: str(e) for name in reports if name not in errors})
     finally:
-        browser.close()
-        playwright.stop()
+        release_context(context)
+    return errors
+
+def _single_report(name):
+    """Run one report in an ECW session of its own, raising its error like the other activities."""
+    error = ecw_report_session([name])[name]
+    if error:
+        raise RuntimeError(f"{name} failed: {error}")
+
+def daily_pro_orders():
+    """The Pro Orders report, in an ECW session of its own."""
+    _single_report('daily_pro_orders')
 
+def dme_orders():
+    """The Next Day Appointments (DME) report, in an ECW session of its own."""
+    _single_report('dme_orders')
 
 
 # ===========================
 # COMTEC
 # ===========================
 
-def daily_call_comtech_report(page,browser,playwright):
-    try:
-        logging.info("Starting daily_call_comtech_report")
-        page.goto(os.getenv("COMTEC_URL"))
-        wait_for_page_load(page)
-        logging.info("Attempting login to Comtech")
-        fill_with_delay(page, 'input[placeholder="Login Name"]', os.getenv("COMTEC_USERNAME"))
-        fill_with_delay(page, 'input[placeholder="Password"]', os.getenv("COMTEC_PASSWORD"))
-        page.get_by_role("button", name="Log In").click()
-        logging.info("Successfully logged into Comtech")
-        wait_for_page_load(page,timeout=120000)
+def open_call_center_reports(page):
+    """Open the Reports modal of the Call Center section."""
+    with span('navigation'):
         # Try multiple selectors to find and click the Call Center link
         call_center = page.locator('a:has-text("Call Center"), [href*="call-center"], [data-module="call-center"]').first
-        call_center.wait_for(state="visible", timeout=60000)
+        wait_for_ready(page, call_center, timeout=60000)
         call_center.click(timeout=60000)
-        wait_for_page_load(page,timeout=120000)
+        wait_for_ready(page, page.get_by_role("button", name="Reports"), timeout=120000)
         logging.info("Navigated to Call Center section")
-        page.get_by_role("button", name="Reports").click()
-        page.wait_for_timeout(9000)
-        page.locator("#stat_type").select_option("abandoned")
-        logging.info("Selected abandoned calls report type")
-        from_date,from_time,to_date,to_time = daily_call_date_range()
-        logging.info(f"Setting date range - From: {from_date} {from_time} To: {to_date} {to_time}")
-        page.locator("#modal-from-0").click()
-        page.locator("#modal-from-0").fill(from_date)
-        page.locator("body").click()
-        page.locator("#modal-from-time").select_option(from_time)
-        page.locator("#modal-to-0").click()
-        page.locator("#modal-to-0").fill(to_date)
-        page.locator("body").click()
-        page.locator("#modal-to-time").select_option(to_time)
-        page.get_by_role("button", name=" ").click()
-        logging.info("Initiating report download")
-        with page.expect_download() as download_info:
-            page.get_by_role("link", name="Download Statistic").click()
-        download = download_info.value
-        download.save_as(os.path.join(download_dir, 'daily_abandoned_calls.csv'))
-        logging.info("Report downloaded successfully as daily_abandoned_calls.csv")
-
-        page.locator("#view-reports-queues").get_by_text("×").click()
+    page.get_by_role("button", name="Reports").click()
+
+def select_call_statistic(page, stat_type, date_range):
+    """Pick a statistic type and the date range in the Reports modal."""
+    wait_for_ready(page, f"#stat_type option[value='{stat_type}']", timeout=60000, state="attached")
+    page.locator("#stat_type").select_option(stat_type)
+    logging.info(f"Selected {stat_type} calls report type")
+    from_date,from_time,to_date,to_time = date_range
+    logging.info(f"Setting date range - From: {from_date} {from_time} To: {to_date} {to_time}")
+    page.locator("#modal-from-0").click()
+    page.locator("#modal-from-0").fill(from_date)
+    page.locator("body").click()
+    page.locator("#modal-from-time").select_option(from_time)
+    page.locator("#modal-to-0").click()
+    page.locator("#modal-to-0").fill(to_date)
+    page.locator("body").click()
+    page.locator("#modal-to-time").select_option(to_time)
+
+def close_call_center_reports(page):
+    """Close the Reports modal and, unless sessions persist, log out."""
+    page.locator("#view-reports-queues").get_by_text("×").click()
+    if not persist_sessions():
         page.get_by_text("Srini Reddy (1010)").click()
-        page.wait_for_timeout(2000)
+        wait_for_ready(page, page.get_by_role("link", name="Log Out"), timeout=30000)
         page.get_by_role("link", name="Log Out").click(no_wait_after=True)
         logging.info("Successfully logged out from Comtech")
+
+@traced()
+def daily_call_comtech_report():
+    context = acquire_context(system='COMTEC')
+    page = context.new_page()
+    try:
+        logging.info("Starting daily_call_comtech_report")
+        login_with_session(page, 'COMTEC')
+        open_call_center_reports(page)
+        with span('report_run'):
+            select_call_statistic(page, 'abandoned', daily_call_date_range())
+        with span('download'):
+            page.get_by_role("button", name=" ").click()
+            logging.info("Initiating report download")
+            download = wait_for_download(page, page.get_by_role("link", name="Download Statistic").click)
+            download.save_as(os.path.join(download_dir, 'daily_abandoned_calls.csv'))
+            logging.info("Report downloaded successfully as daily_abandoned_calls.csv")
+
+        close_call_center_reports(page)
         page.close()
         logging.info("daily_call_comtech_report completed successfully")
     except Exception as e:
         logging.error(f"Error in daily_call_comtech_report: {e}")
+        save_failure_trace(context, 'daily_call_comtech_report')
+        raise  # Re-raise the exception after logging
+    finally:
+        logging.info("Returning browser context to the pool")
+        release_context(context)
+
+@traced()
+def comtec_call_statistics(stat_types=None):
+    """
+    Collect several Comtec statistics in one session, reading the JSON responses the Reports
+    modal loads instead of downloading a CSV per statistic.
+    Args:
+        stat_types: stat_type values to collect (default: those in COMTEC_STAT_TYPES)
+    Returns:
+        dict of stat_type -> rows (header first), ready for google_rows_upload
+    """
+    stat_types = list(stat_types or comtec_stat_types())
+    context = acquire_context(system='COMTEC')
+    page = context.new_page()
+    captured = {}
+    try:
+        logging.info(f"Starting comtec_call_statistics for {', '.join(stat_types)}")
+        login_with_session(page, 'COMTEC')
+        open_call_center_reports(page)
+        date_range = daily_call_date_range()
+        for stat_type in stat_types:
+            with span('capture', stat_type=stat_type):
+                select_call_statistic(page, stat_type, date_range)
+                search = page.get_by_role("button", name=" ")
+                captured[stat_type] = capture_statistic(page, stat_type, search.click)
+
+        close_call_center_reports(page)
+        page.close()
+        logging.info("comtec_call_statistics completed successfully")
+        return {stat_type: captured[stat_type] for stat_type in stat_types}
+    except Exception as e:
+        logging.error(f"Error in comtec_call_statistics: {e}")
+        save_failure_trace(context, 'comtec_call_statistics')
         raise  # Re-raise the exception after logging
     finally:
-        logging.info("Closing browser and playwright")
-        browser.close()
-        playwright.stop()
+        logging.info("Returning browser context to the pool")
+        release_context(context)
         
 
 # ===========================
 # Google Sheet Upload
 # ===========================
-def google_data_upload(download_path, sheet_name, spreadsheet_id, encoding='utf-8',delimiter=','):
+def google_data_upload(download_path, sheet_name, spreadsheet_id, encoding=None,delimiter=None, sync='full'):
+    google_data_upload_many(download_path, [(spreadsheet_id, sheet_name)], encoding=encoding, delimiter=delimiter, sync=sync)
+
+def google_data_upload_many(download_path, targets, encoding=None, delimiter=None, sync='full'):
+    """
+    Upload one CSV to many (spreadsheet_id, sheet_name) targets, parsing the file once.
+    Encoding and delimiter are detected from the file unless given.
+    sync='full' clears and rewrites every tab; sync='diff' only sends rows that changed since the last upload.
+    Tabs that already hold this exact file are skipped.
+    """
     try:
-        credentials = get_user_credentials()
-        service = build('sheets', 'v4', credentials=credentials)
-        
-        # Read data from the CSV file with the correct encoding
-        with open(download_path, 'r', encoding=encoding) as file:  # Adjust encoding if needed
-            csv_reader = csv.reader(file, delimiter=delimiter)
-            csv_data = list(csv_reader)
-
-        # Retrieve the sheet ID for the given sheet name
-        spreadsheet = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        sheet_id = None
-        for sheet in spreadsheet.get('sheets', []):
-            if sheet.get("properties", {}).get("title") == sheet_name:
-                sheet_id = sheet.get("properties", {}).get("sheetId")
-                break
-
-        if sheet_id is None:
-            raise ValueError(f"Sheet with name '{sheet_name}' not found.")
-
-        # Clear existing data in the sheet using batchUpdate
-        requests = [{
-            'updateCells': {
-                'range': {
-                    'sheetId': sheet_id,
-                    'startRowIndex': 0,
-                    'startColumnIndex': 0
-                },
-                'fields': 'userEnteredValue'
-            }
-        }]
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheet_id,
-            body={'requests': requests}
-        ).execute()
-
-        # Append new data to the sheet
-        range_name = f'{sheet_name}!A1'  # Adjust the starting cell as needed
-        body = {
-            'values': csv_data
-        }
-        service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range=range_name,
-            valueInputOption='RAW',
-            insertDataOption='OVERWRITE',
-            body=body
-        ).execute()
-
-        logging.info("Data uploaded successfully to Google Sheet.")
-        
+        # Stream the CSV into every target in fixed-size row batches
+        rows = iter_rows(download_path, encoding=encoding, delimiter=delimiter)
+        google_rows_upload(rows, targets, sync=sync, digest=file_digest(download_path))
     except Exception as e:
-        logging.error(f"Error uploading data to Google: {e}")
\ No newline at end of file
+        logging.error(f"Error uploading data to Google: {e}")
+
+@traced('upload')
+def google_rows_upload(rows, targets, sync='full', digest=None):
+    """
+    Upload any iterator of rows to many (spreadsheet_id, sheet_name) targets.
+    With the content's `digest` (see file_digest), tabs that already hold it are skipped.
+    Raises on failure, after dropping the cached tab metadata.
+    """
+    if digest is not None and skip_unchanged_uploads():
+        unchanged = [target for target in targets if uploaded_digest(*target) == digest]
+        if unchanged:
+            logging.info(f"Skipping {', '.join(sheet_name for _, sheet_name in unchanged)}: content unchanged since the last upload")
+            targets = [target for target in targets if target not in unchanged]
+            if not targets:
+                return 0
+
+    try:
+        if sync == 'diff':
+            written = sync_rows_to_targets(rows, targets)
+        else:
+            written = write_rows_to_targets(rows, targets)
+    except Exception:
+        # Tab metadata may be what went stale (renamed tab, shrunk grid)
+        for spreadsheet_id, _ in targets:
+            invalidate_sheet_cache(spreadsheet_id)
+        record_upload(targets, None)
+        raise
+
+    record_upload(targets, digest)
+    logging.info(f"Data uploaded successfully to {len(targets)} Google Sheet tab(s) ({written} rows, {sync} sync).")
+    return written
\ No newline at end of file
@@ -0,0 +1,248 @@
+import os
+import asyncio
+import logging
+from helper import (ECW_REPORTS, comtec_stat_types, daily_call_date_range, download_dir, ecw_parallel_tabs,
+                    ecw_report_window, fast_export_enabled, persist_sessions, span, traced)
+from async_helper import (acquire_context, capture_statistic, change_report_format_and_download,
+                          login_with_session, open_session_tab, release_context, replay_report_export,
+                          retry_operation, save_failure_trace, select_options_by_label, wait_for_download,
+                          wait_for_page_load, wait_for_ready)
+
+
+# ===========================
+# ECW
+# ===========================
+
+async def fill_ecw_prompts(page, report, window=None):
+    """Answer a report's date, keyword and status prompts (see ECW_REPORTS) and finish it; the dates span `window`."""
+    date_range = report.get('date_range')
+    if date_range:
+        start, end = window
+        await wait_for_ready(page, page.get_by_label("Date Selection"), timeout=90000)
+        await page.get_by_label("Date Selection").select_option("Custom Date", timeout=30000)
+        await page.get_by_label("Text box prompt").click(timeout=30000)
+        await page.get_by_label("Text box prompt").fill(date_range['text_prompt'], timeout=30000)
+        year = page.locator("input[aria-label='Year entry text field']").first
+        await year.wait_for(state="visible", timeout=30000)
+        await year.evaluate("element => element.value = ''")  # Clear the field first
+        await year.fill(str(start.year), timeout=30000)
+        await year.press("Enter")
+        await wait_for_ready(page, page.get_by_role("option", name=start.strftime('%b'), exact=True), timeout=30000)
+        await page.get_by_role("option", name=start.strftime('%b'), exact=True).first.click(timeout=30000)
+        await page.get_by_role("option", name=str(start.day), exact=True).first.click(timeout=30000)
+        await page.get_by_role("option", name=end.strftime('%b'), exact=True).nth(1).click(timeout=30000)
+        await page.get_by_role("option", name=str(end.day), exact=True).nth(1).click(timeout=30000)
+        await page.get_by_role("button", name="OK").click()
+        logging.info("Date selected successfully")
+    if report.get('keywords'):
+        await wait_for_ready(page, page.get_by_label("Keywords:"), timeout=90000)
+        await page.get_by_label("Keywords:").first.click()
+        await page.get_by_label("Keywords:").fill(report['keywords'])
+        await page.get_by_role("button", name="Search").click()
+        await page.get_by_role("link", name="Select all", exact=True).nth(1).click()
+        await page.get_by_role("button", name="InsertAdd selected items to").click()
+    if report.get('statuses'):
+        await select_options_by_label(page.locator("select[multiple]").first, report['statuses'])
+    await page.get_by_role("button", name="Finish").click()
+
+async def run_ecw_report(page, name):
+    """Run one ECW_REPORTS report on a logged-in ECW page and download it as <name>.csv."""
+    report = ECW_REPORTS[name]
+    with span('report', report=name):
+        logging.info(f"Starting {name}")
+        with span('navigation'):
+            await page.get_by_role("link", name="Dashboard", exact=True).click()
+            await page.get_by_role("link", name=report['link'], exact=True).click()
+            await wait_for_ready(page, 'img[title="Run Report"]', timeout=120000)
+        with span('report_run'):
+            await retry_operation(page.get_by_label("Run Report").click, policy='ui')
+            logging.info("Report run successfully")
+            if report.get('date_range') or report.get('keywords') or report.get('statuses'):
+                window = ecw_report_window(name) if report.get('date_range') else None
+                await fill_ecw_prompts(page, report, window)
+            await wait_for_ready(page, page.get_by_label("Change report format"), timeout=120000)
+            logging.info("Report finished successfully")
+        await retry_operation(change_report_format_and_download, page=page, download_dir=download_dir, file_name=name, policy='download')
+        logging.info(f"{name} completed successfully")
+
+async def _run_session_report(context, page, name, errors):
+    """Run one report of an ECW session, recording its error in `errors` instead of raising."""
+    try:
+        if ECW_REPORTS[name].get('fast_export') and fast_export_enabled() and await replay_report_export(context, download_dir, name):
+            logging.info(f"{name} completed successfully via direct export")
+        else:
+            await run_ecw_report(page, name)
+        errors[name] = None
+    except Exception as e:
+        logging.error(f"Error in {name}: {e}")
+        if not any(errors.values()):
+            await save_failure_trace(context, name)  # tracing stops at the first saved trace
+        errors[name] = str(e)
+
+@traced()
+async def ecw_report_session(reports=None):
+    """
+    Log in to ECW once, run `reports` (ECW_REPORTS names) and log off once. With ECW_PARALLEL_TABS
+    above 1, up to that many reports run at once, each in its own tab.
+    A failed report is logged and does not stop the others; its download is simply missing.
+    Returns:
+        dict of report name -> error message, or None for reports that downloaded
+    """
+    reports = list(reports or ECW_REPORTS)
+    context = await acquire_context(system='ECW')
+    page = await context.new_page()
+    errors = {}
+    try:
+        logging.info(f"Starting ECW session for {', '.join(reports)}")
+        await login_with_session(page, 'ECW')
+        tabs = ecw_parallel_tabs()
+        if tabs > 1 and len(reports) > 1:
+            # Each report in its own tab of the logged-in context
+            semaphore = asyncio.Semaphore(tabs)
+
+            async def run_in_tab(name):
+                async with semaphore:
+                    tab = await open_session_tab(context, 'ECW')
+                    try:
+                        await _run_session_report(context, tab, name, errors)
+                    finally:
+                        await tab.close()
+
+            await asyncio.gather(*(run_in_tab(name) for name in reports))
+        else:
+            for name in reports:
+                await _run_session_report(context, page, name, errors)
+                if errors[name]:
+                    await login_with_session(page, 'ECW')  # back to a clean dashboard
+        if not persist_sessions():
+            await page.get_by_label("Log Off").click()
+            await wait_for_page_load(page, timeout=120000, state='domcontentloaded')
+        await page.close()
+        logging.info(f"ECW session finished: {sum(error is None for error in errors.values())}/{len(reports)} reports downloaded")
+    except Exception as e:
+        logging.error(f"Error in ecw_report_session: {e}")
+        await save_failure_trace(context, 'ecw_report_session')
+        errors.update({name: str(e) for name in reports if name not in errors})
+    finally:
+        await release_context(context)
+    return errors
+
+async def _single_report(name):
+    """Run one report in an ECW session of its own, raising its error like the other activities."""
+    error = (await ecw_report_session([name]))[name]
+    if error:
+        raise RuntimeError(f"{name} failed: {error}")
+
+async def daily_pro_orders():
+    """The Pro Orders report, in an ECW session of its own."""
+    await _single_report('daily_pro_orders')
+
+async def dme_orders():
+    """The Next Day Appointments (DME) report, in an ECW session of its own."""
+    await _single_report('dme_orders')
+
+
+# ===========================
+# COMTEC
+# ===========================
+
+async def open_call_center_reports(page):
+    """Open the Reports modal of the Call Center section."""
+    with span('navigation'):
+        # Try multiple selectors to find and click the Call Center link
+        call_center = page.locator('a:has-text("Call Center"), [href*="call-center"], [data-module="call-center"]').first
+        await wait_for_ready(page, call_center, timeout=60000)
+        await call_center.click(timeout=60000)
+        await wait_for_ready(page, page.get_by_role("button", name="Reports"), timeout=120000)
+        logging.info("Navigated to Call Center section")
+    await page.get_by_role("button", name="Reports").click()
+
+async def select_call_statistic(page, stat_type, date_range):
+    """Pick a statistic type and the date range in the Reports modal."""
+    await wait_for_ready(page, f"#stat_type option[value='{stat_type}']", timeout=60000, state="attached")
+    await page.locator("#stat_type").select_option(stat_type)
+    logging.info(f"Selected {stat_type} calls report type")
+    from_date,from_time,to_date,to_time = date_range
+    logging.info(f"Setting date range - From: {from_date} {from_time} To: {to_date} {to_time}")
+    await page.locator("#modal-from-0").click()
+    await page.locator("#modal-from-0").fill(from_date)
+    await page.locator("body").click()
+    await page.locator("#modal-from-time").select_option(from_time)
+    await page.locator("#modal-to-0").click()
+    await page.locator("#modal-to-0").fill(to_date)
+    await page.locator("body").click()
+    await page.locator("#modal-to-time").select_option(to_time)
+
+async def close_call_center_reports(page):
+    """Close the Reports modal and, unless sessions persist, log out."""
+    await page.locator("#view-reports-queues").get_by_text("×").click()
+    if not persist_sessions():
+        await page.get_by_text("Srini Reddy (1010)").click()
+        await wait_for_ready(page, page.get_by_role("link", name="Log Out"), timeout=30000)
+        await page.get_by_role("link", name="Log Out").click(no_wait_after=True)
+        logging.info("Successfully logged out from Comtech")
+
+@traced()
+async def daily_call_comtech_report():
+    context = await acquire_context(system='COMTEC')
+    page = await context.new_page()
+    try:
+        logging.info("Starting daily_call_comtech_report")
+        await login_with_session(page, 'COMTEC')
+        await open_call_center_reports(page)
+        with span('report_run'):
+            await select_call_statistic(page, 'abandoned', daily_call_date_range())
+        with span('download'):
+            await page.get_by_role("button", name=" ").click()
+            logging.info("Initiating report download")
+            download = await wait_for_download(page, page.get_by_role("link", name="Download Statistic").click)
+            await download.save_as(os.path.join(download_dir, 'daily_abandoned_calls.csv'))
+            logging.info("Report downloaded successfully as daily_abandoned_calls.csv")
+
+        await close_call_center_reports(page)
+        await page.close()
+        logging.info("daily_call_comtech_report completed successfully")
+    except Exception as e:
+        logging.error(f"Error in daily_call_comtech_report: {e}")
+        await save_failure_trace(context, 'daily_call_comtech_report')
+        raise  # Re-raise the exception after logging
+    finally:
+        logging.info("Returning browser context to the pool")
+        await release_context(context)
+
+@traced()
+async def comtec_call_statistics(stat_types=None):
+    """
+    Collect several Comtec statistics in one session, reading the JSON responses the Reports
+    modal loads instead of downloading a CSV per statistic.
+    Args:
+        stat_types: stat_type values to collect (default: those in COMTEC_STAT_TYPES)
+    Returns:
+        dict of stat_type -> rows (header first), ready for google_rows_upload
+    """
+    stat_types = list(stat_types or comtec_stat_types())
+    context = await acquire_context(system='COMTEC')
+    page = await context.new_page()
+    captured = {}
+    try:
+        logging.info(f"Starting comtec_call_statistics for {', '.join(stat_types)}")
+        await login_with_session(page, 'COMTEC')
+        await open_call_center_reports(page)
+        date_range = daily_call_date_range()
+        for stat_type in stat_types:
+            with span('capture', stat_type=stat_type):
+                await select_call_statistic(page, stat_type, date_range)
+                search = page.get_by_role("button", name=" ")
+                captured[stat_type] = await capture_statistic(page, stat_type, search.click)
+
+        await close_call_center_reports(page)
+        await page.close()
+        logging.info("comtec_call_statistics completed successfully")
+        return {stat_type: captured[stat_type] for stat_type in stat_types}
+    except Exception as e:
+        logging.error(f"Error in comtec_call_statistics: {e}")
+        await save_failure_trace(context, 'comtec_call_statistics')
+        raise  # Re-raise the exception after logging
+    finally:
+        logging.info("Returning browser context to the pool")
+        await release_context(context)
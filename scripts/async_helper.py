@@ -0,0 +1,332 @@
+import os
+import asyncio
+import inspect
+import logging
+from playwright.async_api import async_playwright
+from helper import (PORTAL_RESOURCES, SELECT_LABELS_SCRIPT, SESSION_SYSTEMS, USER_AGENT, allowed_hosts,
+                    browser_channel, browser_profile, failure_trace_path, is_report_export,
+                    is_statistic_response, load_export_recipe, load_session_state, next_retry_delay,
+                    persist_sessions, playwright_traces_enabled, resource_filter_enabled, retry_policy,
+                    save_export_recipe, should_block_request, statistic_rows, timed_wait, trace_dir, traced,
+                    write_session_state)
+from run_state import checkpoint_stage
+
+
+# ===========================
+# Browser Operations (async)
+# ===========================
+
+async def _launch_chrome(playwright, headless=True):
+    """Start a Chrome process on the given async Playwright driver."""
+    args = list(browser_profile()['args'])
+    if headless:
+        args.append('--headless=new')
+
+    return await playwright.chromium.launch(
+        channel=browser_channel(),
+        headless=False,  # Disable built-in headless to use the new flag instead.
+        args=args,
+        timeout=120000  # Increase browser launch timeout to 120 seconds
+    )
+
+async def _new_context(browser, storage_state=None):
+    """Create a fresh, isolated context with the profile's viewport and the standard user agent."""
+    return await browser.new_context(
+        viewport=browser_profile()['viewport'],
+        user_agent=USER_AGENT,
+        accept_downloads=True,
+        storage_state=storage_state
+    )
+
+async def launch_browser(headless=True):
+    """Launch a fresh Chrome browser instance without persistent data using new headless mode."""
+    playwright = await async_playwright().start()
+    browser = await _launch_chrome(playwright, headless)
+    context = await _new_context(browser)
+    page = await context.new_page()
+
+    return browser, playwright, page
+
+async def wait_for_page_load(page, timeout=60000, state='load'):
+    """Wait for a single load state instead of chaining domcontentloaded, networkidle and load."""
+    try:
+        with timed_wait(f"page {state}"):
+            await page.wait_for_load_state(state, timeout=timeout)
+    except Exception as e:
+        logging.warning(f"Wait for page load warning: {str(e)}")
+
+async def wait_for_element(page, selector, timeout=60000):
+    """Wait for an element to be visible."""
+    try:
+        with timed_wait(f"element '{selector}'"):
+            element = await page.wait_for_selector(selector, timeout=timeout)
+        return element
+    except Exception as e:
+        logging.warning(f"Wait for element failed: {str(e)}")
+        return None
+
+async def wait_for_ready(page, target, timeout=60000, state='visible'):
+    """Wait until the element that marks the next step as ready reaches `state`."""
+    locator = page.locator(target) if isinstance(target, str) else target
+    with timed_wait(f"{target if isinstance(target, str) else 'locator'} {state}"):
+        await locator.first.wait_for(state=state, timeout=timeout)
+
+async def wait_for_response(page, url_pattern, action, timeout=60000):
+    """Run `action` and wait for the first response whose URL matches `url_pattern` (or that a predicate accepts)."""
+    with timed_wait(f"response {getattr(url_pattern, '__name__', url_pattern)}"):
+        async with page.expect_response(url_pattern, timeout=timeout) as response_info:
+            await action()
+    return await response_info.value
+
+async def wait_for_download(page, action, timeout=90000):
+    """Run `action` and wait for the download it triggers."""
+    with timed_wait("download"):
+        async with page.expect_download(timeout=timeout) as download_info:
+            await action()
+    return await download_info.value
+
+async def apply_resource_filter(context, system):
+    """Route every request of `context` through the portal's filter. Routing disables the HTTP cache."""
+    hosts = allowed_hosts(system)
+
+    async def handle(route):
+        if should_block_request(system, route.request.resource_type, route.request.url, hosts):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await context.route('**/*', handle)
+    logging.info(f"Filtering {system} resources (blocked types: {', '.join(PORTAL_RESOURCES[system]['block_types'])}; hosts: {', '.join(sorted(hosts)) or 'any'})")
+
+# ===========================
+# Browser Pool (async)
+# ===========================
+
+# One driver per process; all contexts are driven from the same event loop.
+_playwright = None
+_browsers = []
+_pool_lock = None
+
+async def get_pooled_browser(headless=True, max_browsers=None):
+    """Return a warm Chrome process, launching one only when the pool has no free slot."""
+    global _playwright, _browsers, _pool_lock
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+
+    async with _pool_lock:
+        if _playwright is None:
+            _playwright = await async_playwright().start()
+            logging.info("Started async Playwright driver for browser pool")
+
+        if max_browsers is None:
+            max_browsers = int(os.getenv('BROWSER_POOL_SIZE', '1'))
+
+        _browsers = [browser for browser in _browsers if browser.is_connected()]
+        if _browsers:
+            browser = min(_browsers, key=lambda b: len(b.contexts))
+            if not browser.contexts or len(_browsers) >= max_browsers:
+                return browser
+
+        browser = await _launch_chrome(_playwright, headless)
+        _browsers.append(browser)
+        logging.info(f"Launched pooled browser ({len(_browsers)}/{max_browsers})")
+        return browser
+
+async def acquire_context(headless=True, system=None):
+    """Borrow a fresh isolated BrowserContext from the pool, preloaded with the saved session for `system`."""
+    storage_state = load_session_state(system) if system is not None else None
+    context = await _new_context(await get_pooled_browser(headless), storage_state=storage_state)
+    if system is not None and resource_filter_enabled():
+        await apply_resource_filter(context, system)
+    if playwright_traces_enabled():
+        await context.tracing.start(screenshots=True, snapshots=True)
+    return context
+
+async def release_context(context):
+    """Return a borrowed context to the pool, discarding its cookies and pages."""
+    try:
+        await context.close()
+    except Exception as e:
+        logging.warning(f"Failed to close browser context: {str(e)}")
+
+async def close_browser_pool():
+    """Close every pooled browser and stop the async Playwright driver."""
+    global _playwright, _browsers
+    for browser in _browsers:
+        try:
+            await browser.close()
+        except Exception as e:
+            logging.warning(f"Failed to close pooled browser: {str(e)}")
+    _browsers = []
+    if _playwright is not None:
+        await _playwright.stop()
+        _playwright = None
+        logging.info("Async browser pool closed")
+
+# ===========================
+# Report Filters (async)
+# ===========================
+
+async def select_options_by_label(listbox, labels):
+    """Add the options with exactly these labels to a select[multiple]'s selection; returns the labels not found."""
+    missing = await listbox.evaluate(SELECT_LABELS_SCRIPT, list(labels))
+    if missing:
+        logging.warning(f"Options not found in listbox: {', '.join(repr(label) for label in missing)}")
+    return missing
+
+# ===========================
+# Session Cache (async)
+# ===========================
+
+async def save_session(context, system):
+    """Save the context's cookies and local storage for the next run."""
+    write_session_state(system, await context.storage_state())
+
+async def session_probe(page, system, timeout=15000):
+    """Return True when the portal shows the logged-in view instead of the login form."""
+    config = SESSION_SYSTEMS[system]
+    try:
+        await page.locator(f"{config['username_selector']}, {config['ready_selector']}").first.wait_for(state='visible', timeout=timeout)
+        return await page.locator(config['ready_selector']).first.is_visible()
+    except Exception as e:
+        logging.warning(f"Session probe for {system} failed: {str(e)}")
+        return False
+
+async def open_session_tab(context, system):
+    """Open another tab of a portal the context is already logged in to."""
+    page = await context.new_page()
+    await page.goto(os.getenv(SESSION_SYSTEMS[system]['url_env']))
+    await page.locator(SESSION_SYSTEMS[system]['ready_selector']).first.wait_for(state='visible', timeout=60000)
+    return page
+
+@traced('login')
+async def login_with_session(page, system):
+    """Open the portal and log in, reusing the saved session when it is still valid."""
+    config = SESSION_SYSTEMS[system]
+    await page.goto(os.getenv(config['url_env']))
+    await wait_for_page_load(page, state='domcontentloaded')
+
+    if await session_probe(page, system):
+        logging.info(f"Reused saved {system} session")
+        checkpoint_stage('login', system=system, reused=True)
+        return
+
+    logging.info(f"Saved {system} session missing or expired, logging in")
+    await fill_with_delay(page, config['username_selector'], os.getenv(config['username_env']))
+    await fill_with_delay(page, config['password_selector'], os.getenv(config['password_env']))
+    await page.get_by_role("button", name=config['login_button']).click()
+    await page.locator(config['ready_selector']).first.wait_for(state='visible', timeout=60000)
+    logging.info(f"Logged in to {system} successfully")
+    checkpoint_stage('login', system=system, reused=False)
+
+    if persist_sessions():
+        await save_session(page.context, system)
+
+# ===========================
+# Report Downloading (async)
+# ===========================
+
+@traced('download')
+async def change_report_format_and_download(page, download_dir, file_name):
+    """Change report format and download the report."""
+    logging.info("Attempting to change report format and download")
+
+    await page.get_by_label("Change report format").click()
+    await page.get_by_role("cell", name="View in Excel Options View in").click()
+
+    # Record the export request so later runs can replay it without the UI
+    export_requests = []
+    on_request = lambda request: export_requests.append(request)
+    page.on("request", on_request)
+    try:
+        download = await wait_for_download(page, page.get_by_role("cell", name="View in CSV Format View in").click, timeout=90000)
+    finally:
+        page.remove_listener("request", on_request)
+    save_path = os.path.join(download_dir, f"{file_name}.csv")
+    await download.save_as(save_path)
+    save_export_recipe(file_name, download.url, export_requests)
+
+    logging.info("Report downloaded successfully")
+
+@traced('direct_export')
+async def replay_report_export(context, download_dir, file_name, timeout=90000):
+    """
+    Fetch a report by replaying its recorded export request with the context's session cookies.
+    Returns:
+        True when the CSV was saved, False when the caller should fall back to the UI flow
+    """
+    recipe = load_export_recipe(file_name)
+    if recipe is None:
+        return False
+
+    try:
+        with timed_wait(f"direct export of {file_name}"):
+            response = await context.request.fetch(
+                recipe['url'],
+                method=recipe['method'],
+                headers=recipe['headers'],
+                data=recipe['post_data'],
+                timeout=timeout
+            )
+            body = await response.body()
+        if not is_report_export(response.status, response.headers.get('content-type', ''), body):
+            logging.warning(f"Direct export of {file_name} returned an unexpected response ({response.status}), using UI flow")
+            return False
+    except Exception as e:
+        logging.warning(f"Direct export of {file_name} failed, using UI flow: {str(e)}")
+        return False
+
+    with open(os.path.join(download_dir, f"{file_name}.csv"), 'wb') as report_file:
+        report_file.write(body)
+    logging.info(f"Report {file_name} downloaded via direct export")
+    return True
+
+async def capture_statistic(page, stat_type, action, timeout=60000):
+    """
+    Run `action` (the search click) and read the statistics response it triggers for `stat_type`.
+    Returns:
+        rows, header first
+    """
+    def statistics_response(response):
+        return is_statistic_response(response, stat_type)
+
+    response = await wait_for_response(page, statistics_response, action, timeout=timeout)
+    rows = statistic_rows(await response.json())
+    logging.info(f"Captured {len(rows) - 1} {stat_type} rows from {response.url}")
+    return rows
+
+async def save_failure_trace(context, name):
+    """Save the context's Playwright trace after a failure, if tracing is on."""
+    if not playwright_traces_enabled():
+        return
+    try:
+        os.makedirs(trace_dir, exist_ok=True)
+        await context.tracing.stop(path=failure_trace_path(name))
+        logging.info(f"Saved Playwright trace to {failure_trace_path(name)}")
+    except Exception as e:
+        logging.warning(f"Could not save Playwright trace: {str(e)}")
+
+# ===========================
+# Text Input Utilities (async)
+# ===========================
+
+async def fill_with_delay(page, selector, text, delay=50):
+    """Type text into an element with a delay between each character."""
+    for char in text:
+        await page.locator(selector).type(char, delay=delay)
+
+async def retry_operation(operation, *args, policy='default', **kwargs):
+    """Async retry_operation: awaits awaitable results and backs off with asyncio.sleep, so other jobs keep running."""
+    policy = retry_policy(policy)
+    name = getattr(operation, '__name__', 'operation')
+    for attempt in range(policy['attempts']):
+        try:
+            result = operation(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            delay = next_retry_delay(policy, attempt, e, name)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
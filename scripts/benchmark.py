@@ -0,0 +1,653 @@
+import os
+import io
+import re
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+from google.auth.credentials import AnonymousCredentials
+import helper
+import sheets
+import activity
+from workers import process_tree_rss_mb
+from ingest import iter_rows
+import logging
+
+
+# ===========================
+# Offline Benchmark
+# ===========================
+#
+# Drives the real activities and uploader against local stand-ins for ECW, Comtec and the
+# Sheets v4 API, so a change can be timed end to end without a portal login or a Google quota.
+#
+#   python benchmark.py --ecw-rows 20000 --latency-ms 50 --ui-delay-ms 200 --rounds 2
+#
+# The browser stages need Playwright's Chromium (`playwright install chromium`) or Chrome
+# with --channel chrome. `--stages google_data_upload` benchmarks the uploader alone.
+
+STAGES = ['daily_pro_orders', 'dme_orders', 'ecw_report_session', 'daily_call_comtech_report', 'comtec_call_statistics', 'google_data_upload']
+BENCH_SPREADSHEET_ID = 'bench-spreadsheet'
+BENCH_TABS = ['Main', 'PS', 'DR', 'Data']
+
+ECW_STATUSES = [
+    "*Auth Denied", "*Auth Submitted", "*Declined", "*Done", "*Duplicate",
+    "*Info updated", "*Lock Note", "*Missing Info", "*Peer to Peer",
+    "*Pending Auth", "*Pending Estimate", "*PT/Imaging Needed",
+    "*Ready to Schedule", "*Ready To Schedule BT", "*Ready To Schedule PC",
+    "*Scheduled", "*Cancelled",
+]
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# ===========================
+# Fake Report Files
+# ===========================
+
+def ecw_report(report, rows, seed=0):
+    """A UTF-16, tab-delimited ECW export with `rows` orders."""
+    rng = random.Random(f"{report}-{seed}")
+    start = datetime(2024, 6, 1)
+    lines = ['\t'.join(['Order Date', 'Patient', 'Account No', 'Order', 'Status', 'Insurance', 'Amount'])]
+    for index in range(rows):
+        lines.append('\t'.join([
+            (start + timedelta(days=rng.randrange(365))).strftime('%m/%d/%Y'),
+            f"Patient {rng.randrange(100000)}",
+            str(100000 + index),
+            rng.choice(['MRI Lumbar', 'PT Eval', 'X-Ray Knee', 'DME Brace', 'CT Head']),
+            rng.choice(ECW_STATUSES),
+            rng.choice(['Medicare', 'BCBS', 'Aetna', 'Self Pay']),
+            f"{rng.uniform(10, 5000):,.2f}",
+        ]))
+    return ('\n'.join(lines) + '\n').encode('utf-16')
+
+def comtec_report(rows, seed=0):
+    """A UTF-8 comma-delimited Comtec abandoned-calls statistic with `rows` calls."""
+    rng = random.Random(f"comtec-{seed}")
+    start = datetime(2024, 6, 1, 8)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Date', 'Queue', 'Caller ID', 'Wait Seconds', 'Position'])
+    for _ in range(rows):
+        writer.writerow([
+            (start + timedelta(minutes=rng.randrange(60 * 24 * 30))).strftime('%Y-%m-%d %H:%M:%S'),
+            rng.choice(['Scheduling', 'Billing', 'Front Desk']),
+            f"555{rng.randrange(10 ** 7):07d}",
+            rng.randrange(5, 900),
+            rng.randrange(1, 12),
+        ])
+    return output.getvalue().encode('utf-8')
+
+# ===========================
+# Fake Portal Pages
+# ===========================
+
+# Every step reveals the next one after UI_DELAY ms, like the real single-page portals.
+ECW_PAGE = """<!doctype html>
+<html><head><title>eClinicalWorks (benchmark)</title><style>.hidden{display:none}</style></head>
+<body>
+<div id="login" class="hidden">
+  <input id="username"> <input id="password" type="password"> <button id="login-button">Login</button>
+</div>
+<div id="app" class="hidden">
+  <a href="#" id="dashboard">Dashboard</a> <a href="#" id="logoff" aria-label="Log Off">Log Off</a>
+  <div id="reports" class="hidden">
+    <a href="#" data-report="daily_pro_orders">Shortcut to Pro Orders with Ins RS</a>
+    <a href="#" data-report="dme_orders">Report View of 4.14 - Next Day Appointments</a>
+  </div>
+  <div id="report" class="hidden">
+    <img id="run-report" title="Run Report" aria-label="Run Report" alt="Run Report" width="16" height="16"
+         src="data:image/gif;base64,R0lGODlhAQABAAAAACw=">
+  </div>
+  <div id="prompts" class="hidden">
+    <select aria-label="Date Selection"><option>Today</option><option>Custom Date</option></select>
+    <input aria-label="Text box prompt">
+    <input id="year" aria-label="Year entry text field">
+    <div id="calendar" class="hidden">__CALENDAR__</div>
+    <button id="ok">OK</button>
+  </div>
+  <div id="filters" class="hidden">
+    <input aria-label="Keywords:"> <button>Search</button>
+    <a href="#">Select all</a> <a href="#">Select all</a>
+    <button aria-label="InsertAdd selected items to">Insert</button>
+    <select multiple size="20">__STATUSES__</select>
+    <button id="finish">Finish</button>
+  </div>
+  <div id="output" class="hidden">
+    <a href="#" id="format" aria-label="Change report format">Format</a>
+    <table id="format-menu" class="hidden">
+      <tr><td id="excel">View in Excel Options View in</td></tr>
+      <tr><td id="csv" class="hidden">View in CSV Format View in</td></tr>
+    </table>
+  </div>
+</div>
+<script>
+const UI_DELAY = __UI_DELAY__;
+let report = null;
+const $ = id => document.getElementById(id);
+const show = id => $(id).classList.remove('hidden');
+const hide = id => $(id).classList.add('hidden');
+const later = fn => event => { event && event.preventDefault(); setTimeout(fn, UI_DELAY); };
+
+if (document.cookie.includes('ecw_session=')) show('app'); else show('login');
+$('login-button').onclick = later(() => { document.cookie = 'ecw_session=bench; path=/'; hide('login'); show('app'); });
+$('logoff').onclick = event => { event.preventDefault(); document.cookie = 'ecw_session=; path=/; max-age=0'; location.reload(); };
+// Going back to the dashboard resets the report view, so one session can run several reports
+$('dashboard').onclick = later(() => { ['report', 'prompts', 'calendar', 'filters', 'output', 'format-menu', 'csv'].forEach(hide); show('reports'); });
+document.querySelectorAll('[data-report]').forEach(link => link.onclick = later(() => { report = link.dataset.report; show('report'); }));
+$('run-report').onclick = later(() => report === 'daily_pro_orders' ? show('prompts') : show('output'));
+$('year').onkeydown = event => { if (event.key === 'Enter') setTimeout(() => show('calendar'), UI_DELAY); };
+$('ok').onclick = later(() => show('filters'));
+$('finish').onclick = later(() => show('output'));
+$('format').onclick = event => { event.preventDefault(); show('format-menu'); };
+$('excel').onclick = () => show('csv');
+$('csv').onclick = () => { window.location = '/ecw/export?report=' + report; };
+</script>
+</body></html>
+"""
+
+COMTEC_PAGE = """<!doctype html>
+<html><head><title>Comtec (benchmark)</title><style>.hidden{display:none} body{min-height:2000px}</style></head>
+<body>
+<div id="login" class="hidden">
+  <input placeholder="Login Name"> <input placeholder="Password" type="password"> <button id="login-button">Log In</button>
+</div>
+<div id="app" class="hidden">
+  <a href="#" id="call-center">Call Center</a>
+  <span id="user">Srini Reddy (1010)</span>
+  <div id="user-menu" class="hidden"><a href="#" id="logout">Log Out</a></div>
+  <div id="call-center-view" class="hidden"><button id="reports">Reports</button></div>
+  <div id="view-reports-queues" class="hidden">
+    <select id="stat_type"></select>
+    <input id="modal-from-0"> <select id="modal-from-time">__HOURS__</select>
+    <input id="modal-to-0"> <select id="modal-to-time">__HOURS__</select>
+    <button id="search"> </button>
+    <a href="#" id="download" class="hidden">Download Statistic</a>
+    <span id="close">×</span>
+  </div>
+</div>
+<script>
+const UI_DELAY = __UI_DELAY__;
+const $ = id => document.getElementById(id);
+const show = id => $(id).classList.remove('hidden');
+const hide = id => $(id).classList.add('hidden');
+const later = fn => event => { event && event.preventDefault(); setTimeout(fn, UI_DELAY); };
+
+if (document.cookie.includes('comtec_session=')) show('app'); else show('login');
+$('login-button').onclick = later(() => { document.cookie = 'comtec_session=bench; path=/'; hide('login'); show('app'); });
+$('user').onclick = () => show('user-menu');
+$('logout').onclick = event => { event.preventDefault(); document.cookie = 'comtec_session=; path=/; max-age=0'; location.reload(); };
+$('call-center').onclick = later(() => show('call-center-view'));
+$('reports').onclick = later(() => {
+  show('view-reports-queues');
+  $('stat_type').innerHTML = ['answered', 'abandoned', 'missed'].map(type => `<option value="${type}">${type}</option>`).join('');
+});
+const statQuery = () => new URLSearchParams({stat_type: $('stat_type').value, from: $('modal-from-0').value, to: $('modal-to-0').value});
+// Like the real modal, the statistic is loaded as JSON before the download link appears
+$('search').onclick = later(() => fetch('/comtec/stats?' + statQuery()).then(response => response.json()).then(() => show('download')));
+$('download').onclick = event => {
+  event.preventDefault();
+  window.location = '/comtec/export?' + statQuery();
+};
+$('close').onclick = () => hide('view-reports-queues');
+</script>
+</body></html>
+"""
+
+def render_ecw_page(ui_delay_ms):
+    """The fake ECW page, with two month/day pickers (start and end date) and the status listbox."""
+    pickers = []
+    for _ in range(2):
+        pickers.append('<div role="listbox">' + ''.join(f'<div role="option">{month}</div>' for month in MONTHS) + '</div>')
+        pickers.append('<div role="listbox">' + ''.join(f'<div role="option">{day}</div>' for day in range(1, 32)) + '</div>')
+    statuses = ''.join(f'<option>{status}</option>' for status in [''] + ECW_STATUSES)
+    return (ECW_PAGE
+            .replace('__CALENDAR__', ''.join(pickers))
+            .replace('__STATUSES__', statuses)
+            .replace('__UI_DELAY__', str(int(ui_delay_ms))))
+
+def render_comtec_page(ui_delay_ms):
+    """The fake Comtec Call Center page with hourly time pickers."""
+    hours = ''.join(f'<option value="{hour:02d}:00:00">{hour:02d}:00:00</option>' for hour in range(24))
+    return COMTEC_PAGE.replace('__HOURS__', hours).replace('__UI_DELAY__', str(int(ui_delay_ms)))
+
+# ===========================
+# Stand-in Servers
+# ===========================
+
+class StandInServer(ThreadingHTTPServer):
+    """Local HTTP server that counts requests by kind and delays every response by `latency` seconds."""
+    daemon_threads = True
+
+    def __init__(self, name, handler, latency=0.0, **state):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.name = name
+        self.latency = latency
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.state = state
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=f"{self.name}-stand-in", daemon=True).start()
+        return self
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Shared plumbing: latency, request counting and responses. Subclasses implement route()."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmark output readable
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        time.sleep(self.server.latency)
+        kind, status, content_type, payload, headers = self.route(method, urlparse(self.path), body)
+        with self.server.lock:
+            self.server.counts[kind] += 1
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def has_cookie(self, name):
+        return f"{name}=" in (self.headers.get('Cookie') or '')
+
+    def route(self, method, url, body):
+        raise NotImplementedError
+
+def attachment(name, payload, content_type='text/csv'):
+    """Response tuple for a file download."""
+    return 200, content_type, payload, {'Content-Disposition': f'attachment; filename="{name}"'}
+
+class EcwHandler(StandInHandler):
+    def route(self, method, url, body):
+        state = self.server.state
+        if url.path.rstrip('/') == '/ecw':
+            return ('page', 200, 'text/html; charset=utf-8', state['page'].encode('utf-8'), None)
+        if url.path == '/ecw/export':
+            report = parse_qs(url.query).get('report', [''])[0]
+            if report not in state['reports'] or not self.has_cookie('ecw_session'):
+                # Expired sessions get the login page, as the real portal does
+                return ('export', 200, 'text/html; charset=utf-8', state['page'].encode('utf-8'), None)
+            return ('export',) + attachment(f"{report}.csv", state['reports'][report])
+        return ('other', 404, 'text/plain', b'not found', None)
+
+class ComtecHandler(StandInHandler):
+    def route(self, method, url, body):
+        state = self.server.state
+        if url.path.rstrip('/') == '/comtec':
+            return ('page', 200, 'text/html; charset=utf-8', state['page'].encode('utf-8'), None)
+        if url.path == '/comtec/export' and self.has_cookie('comtec_session'):
+            return ('export',) + attachment('statistic.csv', state['report'])
+        if url.path == '/comtec/stats' and self.has_cookie('comtec_session'):
+            header, *rows = csv.reader(io.StringIO(state['report'].decode('utf-8')))
+            payload = json.dumps({'stat_type': parse_qs(url.query).get('stat_type', [''])[0], 'columns': header, 'data': rows})
+            return ('stats', 200, 'application/json', payload.encode('utf-8'), None)
+        return ('other', 404, 'text/plain', b'not found', None)
+
+# A1 ranges as written by sheets.a1_range: 'Tab'!A1:F5000
+A1_PATTERN = re.compile(r"^'?(?P<title>.*?)'?!A(?P<start>\d+)(?::[A-Z]+(?P<end>\d+))?$")
+
+class SheetsHandler(StandInHandler):
+    """Just enough of the Sheets v4 API for helper's uploaders: tab metadata, batchUpdate, values writes and clears."""
+
+    def route(self, method, url, body):
+        match = re.match(r'^/v4/spreadsheets/([^/:]+)(.*)$', url.path)
+        if not match:
+            return ('other', 404, 'application/json', b'{}', None)
+        spreadsheet_id, rest = unquote(match.group(1)), unquote(match.group(2))
+        request = json.loads(body or b'{}')
+        tabs = self.spreadsheet(spreadsheet_id)
+
+        if method == 'GET' and not rest:
+            kind, response = 'spreadsheets.get', {'sheets': [{'properties': tab['properties']} for tab in tabs.values()]}
+        elif rest == ':batchUpdate':
+            kind, response = 'spreadsheets.batchUpdate', self.batch_update(tabs, request)
+        elif rest == '/values:batchUpdate':
+            kind, response = 'values.batchUpdate', self.write_values(tabs, request.get('data', []))
+        elif rest.startswith('/values/') and rest.endswith(':clear'):
+            kind, response = 'values.clear', self.clear_values(tabs, rest[len('/values/'):-len(':clear')])
+        elif rest.startswith('/values/') and method == 'PUT':
+            kind, response = 'values.update', self.write_values(tabs, [dict(request, range=rest[len('/values/'):])])
+        else:
+            return ('other', 404, 'application/json', b'{}', None)
+        response['spreadsheetId'] = spreadsheet_id
+        return (kind, 200, 'application/json', json.dumps(response).encode('utf-8'), None)
+
+    def spreadsheet(self, spreadsheet_id):
+        spreadsheets = self.server.state['spreadsheets']
+        with self.server.lock:
+            if spreadsheet_id not in spreadsheets:
+                spreadsheets[spreadsheet_id] = {
+                    title: {
+                        'properties': {'sheetId': index, 'title': title, 'gridProperties': {'rowCount': 1000, 'columnCount': 26}},
+                        'rows': {},
+                    }
+                    for index, title in enumerate(BENCH_TABS)
+                }
+            return spreadsheets[spreadsheet_id]
+
+    def batch_update(self, tabs, request):
+        by_id = {tab['properties']['sheetId']: tab for tab in tabs.values()}
+        replies = []
+        with self.server.lock:
+            for item in request.get('requests', []):
+                if 'updateCells' in item:
+                    by_id[item['updateCells']['range']['sheetId']]['rows'].clear()
+                elif 'appendDimension' in item:
+                    append = item['appendDimension']
+                    grid = by_id[append['sheetId']]['properties']['gridProperties']
+                    key = 'rowCount' if append['dimension'] == 'ROWS' else 'columnCount'
+                    grid[key] += append['length']
+                replies.append({})
+        return {'replies': replies}
+
+    def write_values(self, tabs, data):
+        updated = 0
+        with self.server.lock:
+            for item in data:
+                match = A1_PATTERN.match(item['range'])
+                tab = tabs[match.group('title').replace("''", "'")]
+                start = int(match.group('start'))
+                if start + len(item.get('values', [])) - 1 > tab['properties']['gridProperties']['rowCount']:
+                    raise ValueError(f"Range {item['range']} exceeds grid limits")
+                for offset, row in enumerate(item.get('values', [])):
+                    tab['rows'][start + offset] = row
+                updated += len(item.get('values', []))
+        return {'totalUpdatedRows': updated}
+
+    def clear_values(self, tabs, range_name):
+        match = A1_PATTERN.match(range_name)
+        tab = tabs[match.group('title').replace("''", "'")]
+        start = int(match.group('start'))
+        end = int(match.group('end') or tab['properties']['gridProperties']['rowCount'])
+        with self.server.lock:
+            for row in range(start, end + 1):
+                tab['rows'].pop(row, None)
+        return {'clearedRange': range_name}
+
+def sheet_row_count(server, spreadsheet_id, tab):
+    """Number of rows currently holding values in a stand-in tab."""
+    with server.lock:
+        rows = server.state['spreadsheets'].get(spreadsheet_id, {}).get(tab, {}).get('rows', {})
+        return len(rows)
+
+# ===========================
+# Benchmark Runner
+# ===========================
+
+def isolate_state(workdir):
+    """Point sessions, recipes, snapshots, traces and downloads at a scratch directory."""
+    for name in ('config', 'downloads', 'traces'):
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    # Sessions, snapshots, manifests and the upload cache all live under config_dir
+    helper.config_dir = os.path.join(workdir, 'config')
+    helper.trace_dir = os.path.join(workdir, 'traces')
+    activity.download_dir = os.path.join(workdir, 'downloads')
+
+    credentials = AnonymousCredentials()
+    sheets.get_user_credentials = lambda: credentials
+    # Later rounds upload the same reports again; they should measure the diff sync, not the cache hit
+    os.environ['SKIP_UNCHANGED_UPLOADS'] = 'false'
+
+RSS_SAMPLE_INTERVAL = 0.05
+
+class RssSampler:
+    """Track the peak resident memory of this process and its browsers while a stage runs."""
+
+    def __init__(self):
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            self.peak_mb = max(self.peak_mb, process_tree_rss_mb())
+            if self._stop.wait(RSS_SAMPLE_INTERVAL):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, process_tree_rss_mb())
+
+def measure(name, func, servers, check=None):
+    """Run one stage and record wall time, peak RSS of the process tree (Python, driver and Chrome) and requests per stand-in."""
+    before = {server.name: Counter(server.counts) for server in servers}
+    started = time.time()
+    status, error = 'ok', None
+    with RssSampler() as rss:
+        try:
+            func()
+            if check is not None:
+                error = check(started)
+                status = 'failed' if error else 'ok'
+        except Exception as e:
+            status, error = 'failed', str(e)
+    wall = time.time() - started
+
+    result = {
+        'stage': name,
+        'status': status,
+        'error': error,
+        'wall_s': round(wall, 3),
+        'peak_rss_mb': round(rss.peak_mb, 1),
+        'requests': {server.name: dict(server.counts - before[server.name]) for server in servers},
+    }
+    logging.info(f"[bench] {name}: {status} in {wall:.2f}s, peak RSS {result['peak_rss_mb']} MB")
+    return result
+
+def fresh_file(path):
+    """Stage check: the file exists and was written by this stage."""
+    def check(started):
+        if not os.path.exists(path) or os.path.getmtime(path) < started - 1:
+            return f"{os.path.basename(path)} missing or stale"
+        return None
+    return check
+
+def rows_uploaded(server, path, tab):
+    """Stage check: the stand-in tab holds every row of the uploaded file."""
+    def check(started):
+        expected = sum(1 for _ in iter_rows(path))
+        actual = sheet_row_count(server, BENCH_SPREADSHEET_ID, tab)
+        return None if actual == expected else f"{tab} holds {actual} rows, expected {expected}"
+    return check
+
+def statistics_captured(captured, stat_types, rows):
+    """Stage check: every statistic was captured with all of its rows."""
+    def check(started):
+        for stat_type in stat_types:
+            if len(captured.get(stat_type, [])) != rows + 1:
+                return f"{stat_type}: captured {max(len(captured.get(stat_type, [])) - 1, 0)} rows, expected {rows}"
+        return None
+    return check
+
+def span_breakdown(trace_dir):
+    """Sum span durations by path from the run's JSON-lines traces."""
+    totals = {}
+    for name in sorted(os.listdir(trace_dir)) if os.path.isdir(trace_dir) else []:
+        if not name.endswith('.jsonl'):
+            continue
+        with open(os.path.join(trace_dir, name)) as trace_file:
+            for line in trace_file:
+                record = json.loads(line)
+                count, seconds = totals.get(record['span'], (0, 0.0))
+                totals[record['span']] = (count + 1, seconds + record['duration_s'])
+    return {path: {'count': count, 'total_s': round(seconds, 3)} for path, (count, seconds) in totals.items()}
+
+def run_benchmark(stages=None, rounds=1, ecw_rows=5000, comtec_rows=500, latency_ms=0, ui_delay_ms=0,
+                  chunk_rows=None, workdir=None):
+    """
+    Run the selected stages against local stand-ins.
+    Args:
+        stages: subset of STAGES (default: all)
+        rounds: how many times to run the stages; later rounds reuse sessions, recipes and snapshots
+        ecw_rows, comtec_rows: rows in the fake ECW and Comtec reports
+        latency_ms: delay added to every stand-in HTTP response
+        ui_delay_ms: delay before each fake portal step appears
+        chunk_rows: Sheets write chunk size (default: SHEETS_CHUNK_ROWS)
+        workdir: scratch directory (default: a new temporary directory)
+    Returns:
+        dict with the settings, per-stage results and the span breakdown
+    """
+    stages = stages or STAGES
+    workdir = workdir or tempfile.mkdtemp(prefix='bench-')
+    isolate_state(workdir)
+    if chunk_rows:
+        sheets.SHEETS_CHUNK_ROWS = chunk_rows
+
+    latency = latency_ms / 1000
+    reports = {'daily_pro_orders': ecw_report('daily_pro_orders', ecw_rows), 'dme_orders': ecw_report('dme_orders', ecw_rows)}
+    ecw = StandInServer('ecw', EcwHandler, latency, page=render_ecw_page(ui_delay_ms), reports=reports).start()
+    comtec = StandInServer('comtec', ComtecHandler, latency, page=render_comtec_page(ui_delay_ms), report=comtec_report(comtec_rows)).start()
+    sheets_server = StandInServer('sheets', SheetsHandler, latency, spreadsheets={}).start()
+    servers = [ecw, comtec, sheets_server]
+
+    os.environ.update({
+        'ECW_URL': f"{ecw.url}/ecw/",
+        'ECW_USERNAME': 'bench',
+        'ECW_PASSWORD': 'bench',
+        'COMTEC_URL': f"{comtec.url}/comtec/",
+        'COMTEC_USERNAME': 'bench',
+        'COMTEC_PASSWORD': 'bench',
+        'SHEETS_API_ENDPOINT': f"{sheets_server.url}/",
+    })
+
+    downloads = activity.download_dir
+    pro_orders_path = os.path.join(downloads, 'daily_pro_orders.csv')
+    calls_path = os.path.join(downloads, 'daily_abandoned_calls.csv')
+    # Without the browser stages, upload the fake reports directly
+    if 'daily_pro_orders' not in stages:
+        with open(pro_orders_path, 'wb') as report_file:
+            report_file.write(reports['daily_pro_orders'])
+    if 'daily_call_comtech_report' not in stages:
+        with open(calls_path, 'wb') as report_file:
+            report_file.write(comtec.state['report'])
+
+    stat_types = ['abandoned', 'answered', 'missed']
+    captured = {}
+    plan = {
+        'daily_pro_orders': [('daily_pro_orders', activity.daily_pro_orders, fresh_file(pro_orders_path))],
+        'dme_orders': [('dme_orders', activity.dme_orders, fresh_file(os.path.join(downloads, 'dme_orders.csv')))],
+        'ecw_report_session': [(
+            'ecw_report_session',
+            activity.ecw_report_session,
+            lambda started: fresh_file(pro_orders_path)(started) or fresh_file(os.path.join(downloads, 'dme_orders.csv'))(started),
+        )],
+        'daily_call_comtech_report': [('daily_call_comtech_report', activity.daily_call_comtech_report, fresh_file(calls_path))],
+        'comtec_call_statistics': [(
+            'comtec_call_statistics',
+            lambda: captured.update(activity.comtec_call_statistics(stat_types)),
+            statistics_captured(captured, stat_types, comtec_rows),
+        )],
+        'google_data_upload': [
+            ('google_data_upload (full)',
+             lambda: activity.google_data_upload(pro_orders_path, 'Main', BENCH_SPREADSHEET_ID),
+             rows_uploaded(sheets_server, pro_orders_path, 'Main')),
+            ('google_data_upload (diff)',
+             lambda: activity.google_data_upload(calls_path, 'Data', BENCH_SPREADSHEET_ID, sync='diff'),
+             rows_uploaded(sheets_server, calls_path, 'Data')),
+        ],
+    }
+
+    results = []
+    try:
+        for round_number in range(1, rounds + 1):
+            for stage in stages:
+                for name, func, check in plan[stage]:
+                    result = measure(name, func, servers, check)
+                    result['round'] = round_number
+                    results.append(result)
+    finally:
+        helper.close_browser_pool()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+    return {
+        'settings': {
+            'stages': stages, 'rounds': rounds, 'ecw_rows': ecw_rows, 'comtec_rows': comtec_rows,
+            'latency_ms': latency_ms, 'ui_delay_ms': ui_delay_ms, 'chunk_rows': sheets.SHEETS_CHUNK_ROWS,
+            'workdir': workdir,
+        },
+        'results': results,
+        'spans': span_breakdown(helper.trace_dir),
+    }
+
+def format_report(report):
+    """Render benchmark results as a plain-text table."""
+    lines = [f"{'round':>5}  {'stage':<28} {'status':<7} {'wall_s':>8} {'rss_mb':>8}  {'ecw':>4} {'comtec':>6} {'sheets':>6}"]
+    for result in report['results']:
+        counts = {name: sum(kinds.values()) for name, kinds in result['requests'].items()}
+        lines.append(
+            f"{result['round']:>5}  {result['stage']:<28} {result['status']:<7} {result['wall_s']:>8.2f} {result['peak_rss_mb']:>8.1f}"
+            f"  {counts['ecw']:>4} {counts['comtec']:>6} {counts['sheets']:>6}"
+            + (f"  ({result['error']})" if result['error'] else '')
+        )
+    lines.append('')
+    lines.append(f"{'span':<60} {'count':>5} {'total_s':>8}")
+    for path, totals in sorted(report['spans'].items()):
+        lines.append(f"{path:<60} {totals['count']:>5} {totals['total_s']:>8.2f}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ECW, Comtec and Sheets flows against local stand-ins.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--rounds', type=int, default=1)
+    parser.add_argument('--ecw-rows', type=int, default=5000)
+    parser.add_argument('--comtec-rows', type=int, default=500)
+    parser.add_argument('--latency-ms', type=int, default=0, help='Delay added to every stand-in HTTP response')
+    parser.add_argument('--ui-delay-ms', type=int, default=0, help='Delay before each fake portal step appears')
+    parser.add_argument('--chunk-rows', type=int, default=None, help='Sheets write chunk size')
+    parser.add_argument('--channel', default=os.getenv('BROWSER_CHANNEL', ''), help="Browser channel ('' for bundled Chromium)")
+    parser.add_argument('--profile', default=os.getenv('BROWSER_PROFILE', 'chrome'), choices=sorted(helper.BROWSER_PROFILES))
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    helper.init()
+    os.environ['BROWSER_CHANNEL'] = args.channel
+    os.environ['BROWSER_PROFILE'] = args.profile
+    report = run_benchmark(
+        stages=args.stages,
+        rounds=args.rounds,
+        ecw_rows=args.ecw_rows,
+        comtec_rows=args.comtec_rows,
+        latency_ms=args.latency_ms,
+        ui_delay_ms=args.ui_delay_ms,
+        chunk_rows=args.chunk_rows,
+    )
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,216 +1,783 @@
 import os
 import time
 import re
-from datetime import datetime, timedelta
-import pandas as pd
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from playwright.sync_api import sync_playwright
+import random
+import hashlib
+import json
+import threading
+import inspect
+import functools
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+from datetime import date, datetime, timedelta
 import logging
 from dotenv import load_dotenv
-from google.oauth2.credentials import Credentials
-import pytz
 
+# pandas, the Google client libraries, Playwright and pytz are imported where they are used,
+# so each entry point only pays for what it runs.
 
-# Set up directories
+
+# Directories
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 log_dir = os.path.join(base_dir, 'logs')
 config_dir = os.path.join(base_dir, 'config')
 download_dir = os.path.join(base_dir, 'downloads')
+
+# Loaded on import because module-level settings throughout the scripts read the environment
 load_dotenv(os.path.join(base_dir, '.env'))
 
-# Create necessary directories
-os.makedirs(log_dir, exist_ok=True)
-os.makedirs(config_dir, exist_ok=True)
-os.makedirs(download_dir, exist_ok=True)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(log_dir, 'task.log'), mode='a'),
-        logging.StreamHandler()
-    ]
-)
+_initialized = False
+
+def init():
+    """Create the working directories and configure logging. Entry points call this once, first."""
+    global _initialized
+    if _initialized:
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    os.makedirs(config_dir, exist_ok=True)
+    os.makedirs(download_dir, exist_ok=True)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(log_dir, 'task.log'), mode='a'),
+            logging.StreamHandler()
+        ]
+    )
+    _initialized = True
+
+def write_json_atomic(path, data, **dump_options):
+    """
+    Replace a JSON file in one step, so a crash or a concurrent reader never sees it half-written.
+    The temp name is unique per process and thread, so concurrent writers never share it.
+    """
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'w') as temp_file:
+            json.dump(data, temp_file, **dump_options)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 # ===========================
-# Decorators
+# Retry Policy
 # ===========================
 
-def retry_with_delay(attempts=5, delay=60):
-    """Decorator to retry a function with a delay between attempts."""
+# Delays grow as base_delay * multiplier**n, capped at max_delay; jitter takes up to that
+# fraction off each delay so parallel lanes do not retry in lockstep. `retry_on` lists the
+# error classes (see classify_error) worth another attempt: auth failures never fix themselves.
+RETRY_POLICIES = {
+    'default': {'attempts': 5, 'base_delay': 2.0, 'multiplier': 2.0, 'max_delay': 60.0, 'jitter': 0.5,
+                'retry_on': ('timeout', 'selector', 'network', 'other')},
+    'ui': {'attempts': 4, 'base_delay': 1.0, 'max_delay': 15.0},
+    # A slow export surfaces as a timeout on the download button's locator, so selector errors retry too
+    'download': {'attempts': 3, 'base_delay': 5.0, 'multiplier': 3.0, 'retry_on': ('timeout', 'selector', 'network', 'other')},
+}
+RETRY_BUDGET = int(os.getenv('RETRY_BUDGET', '20'))  # retries per run, shared by every job
+
+SELECTOR_ERROR_PATTERN = re.compile(r'waiting for (locator|selector|get_by)|strict mode violation|not attached|resolved to 0 elements', re.I)
+NETWORK_ERROR_PATTERN = re.compile(r'net::ERR_|ECONNRESET|ECONNREFUSED|connection (reset|refused|aborted)', re.I)
+AUTH_ERROR_PATTERN = re.compile(r'unauthori[sz]ed|forbidden|invalid_grant', re.I)
+
+_retries_used = 0
+_retry_lock = threading.Lock()
+
+def classify_error(error):
+    """Sort an exception into 'auth', 'network', 'selector', 'timeout' or 'other'."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    message = str(error)
+    # Matched by name and attributes, so classifying never imports the Google client libraries
+    if type(error).__name__ == 'RefreshError' or status in (401, 403) or AUTH_ERROR_PATTERN.search(message):
+        return 'auth'
+    if isinstance(error, ConnectionError) or status == 429 or (isinstance(status, int) and status >= 500) \
+            or NETWORK_ERROR_PATTERN.search(message):
+        return 'network'
+    # Playwright reports a missing element as a timeout while waiting for its locator
+    if SELECTOR_ERROR_PATTERN.search(message):
+        return 'selector'
+    if isinstance(error, TimeoutError) or type(error).__name__ == 'TimeoutError':
+        return 'timeout'
+    return 'other'
+
+def retry_policy(policy='default', **overrides):
+    """Resolve a policy name or dict into a complete policy, with optional per-call overrides."""
+    resolved = dict(RETRY_POLICIES['default'])
+    resolved.update(RETRY_POLICIES[policy] if isinstance(policy, str) else policy)
+    resolved.update(overrides)
+    return resolved
+
+def backoff_delay(policy, attempt):
+    """Seconds to wait after the given (0-based) failed attempt."""
+    delay = min(policy['max_delay'], policy['base_delay'] * policy['multiplier'] ** attempt)
+    return delay * (1 - random.uniform(0, policy['jitter']))
+
+def take_retry():
+    """Spend one retry from the run's budget; False once it is exhausted."""
+    global _retries_used
+    with _retry_lock:
+        if _retries_used >= RETRY_BUDGET:
+            return False
+        _retries_used += 1
+        return True
+
+def reset_retry_budget():
+    """Start a fresh retry budget, e.g. for the next run of a long-lived process."""
+    global _retries_used
+    with _retry_lock:
+        _retries_used = 0
+
+def next_retry_delay(policy, attempt, error, name):
+    """
+    Decide what to do after a failed attempt.
+    Returns:
+        Seconds to wait before the next attempt, or None to give up and re-raise
+    """
+    kind = classify_error(error)
+    logging.error(f"Attempt {attempt + 1}/{policy['attempts']} of {name} failed ({kind}): {error}")
+    if kind not in policy['retry_on'] or attempt >= policy['attempts'] - 1:
+        return None
+    if not take_retry():
+        logging.warning(f"Retry budget of {RETRY_BUDGET} exhausted, not retrying {name}")
+        return None
+
+    current = _current_span.get()
+    if current is not None:
+        current['retries'] = current.get('retries', 0) + 1
+    delay = backoff_delay(policy, attempt)
+    logging.info(f"Retrying {name} in {delay:.1f} seconds...")
+    return delay
+
+def retry_operation(operation, *args, policy='default', **kwargs):
+    """
+    Call operation(*args, **kwargs), retrying failures with exponential backoff.
+    Args:
+        operation: Callable to run
+        policy: RETRY_POLICIES name or policy dict (see retry_policy)
+    Returns:
+        The operation's result; the last error is re-raised when retries run out
+    """
+    policy = retry_policy(policy)
+    name = getattr(operation, '__name__', 'operation')
+    for attempt in range(policy['attempts']):
+        job_time_left()  # no new attempt once the job is out of time
+        try:
+            return operation(*args, **kwargs)
+        except JobTimeout:
+            raise
+        except Exception as e:
+            delay = next_retry_delay(policy, attempt, e, name)
+            if delay is None:
+                raise
+            left = job_time_left()
+            time.sleep(delay if left is None else min(delay, left))
+
+def retrying(policy='default'):
+    """Decorator form of retry_operation."""
     def decorator(func):
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            for attempt in range(attempts):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    logging.error(f"Attempt {attempt + 1} failed: {e}")
-                    if attempt < attempts - 1:
-                        logging.info(f"Retrying in {delay} seconds...")
-                        time.sleep(delay)
-            raise Exception(f"All {attempts} attempts failed.")
+            return retry_operation(func, *args, policy=policy, **kwargs)
         return wrapper
     return decorator
 
 # ===========================
-# Google Sheets Operations
+# Job Deadline
 # ===========================
 
-def write_sheet_data(spreadsheet_id, range_name, values, credentials):
-    """Write data to a Google Sheets document."""
-    service = build('sheets', 'v4', credentials=credentials)
-    
-    # Clear the existing data in the specified range
-    service.spreadsheets().values().clear(
-        spreadsheetId=spreadsheet_id,
-        range=range_name
-    ).execute()
-    
-    # Prepare the new data to be written
-    body = {'values': values}
-    
-    # Write the new data to the specified range
-    service.spreadsheets().values().update(
-        spreadsheetId=spreadsheet_id,
-        range=range_name,
-        valueInputOption='USER_ENTERED',
-        body=body
-    ).execute()
-
-def get_user_credentials():
-    """Get user credentials for Google Sheets API."""
-    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-    creds = None
-    token_path = os.path.join(config_dir, 'token.json')
-
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                os.path.join(config_dir, 'credentials.json'), SCOPES)
-            creds = flow.run_local_server(port=0)
+# Sync Playwright calls cannot be interrupted from another thread, so a job's timeout is enforced
+# from inside: every wait helper caps its timeout at the time the job has left, and once that runs
+# out the next wait or retry raises JobTimeout, which unwinds the activity and releases its context.
+_job_deadline = contextvars.ContextVar('job_deadline', default=None)  # (deadline, timeout seconds)
+
+class JobTimeout(TimeoutError):
+    """The current job ran out of time."""
+
+@contextmanager
+def job_deadline(seconds):
+    """Give the code in this block `seconds` to finish; see job_time_left."""
+    token = _job_deadline.set((time.time() + seconds, seconds))
+    try:
+        yield
+    finally:
+        _job_deadline.reset(token)
+
+def job_time_left():
+    """Seconds the current job has left, or None outside job_deadline. Raises JobTimeout once none are left."""
+    current = _job_deadline.get()
+    if current is None:
+        return None
+    deadline, seconds = current
+    left = deadline - time.time()
+    if left <= 0:
+        raise JobTimeout(f"Exceeded {seconds}s timeout")
+    return left
+
+def capped_timeout(timeout):
+    """A Playwright timeout in milliseconds (0 = none), capped at the current job's time left."""
+    left = job_time_left()
+    if left is None:
+        return timeout
+    return min(timeout, left * 1000) if timeout else left * 1000
+
+# ===========================
+# Instrumentation
+# ===========================
+
+trace_dir = os.path.join(log_dir, 'traces')
+RUN_ID = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+# The active span follows threads and asyncio tasks, so nested spans know their parent
+_current_span = contextvars.ContextVar('current_span', default=None)
+_trace_lock = threading.Lock()
+
+def write_trace(record):
+    """Append one span record to today's JSON-lines run trace."""
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(trace_dir, f"{datetime.now().strftime('%Y-%m-%d')}.jsonl")
+    with _trace_lock, open(path, 'a') as trace_file:
+        trace_file.write(json.dumps(record, default=str) + '\n')
+
+@contextmanager
+def span(name, **attributes):
+    """Time a step, log its duration and write it to the run trace, nested under the active span."""
+    parent = _current_span.get()
+    record = {
+        'run_id': RUN_ID,
+        'span': f"{parent['span']}/{name}" if parent else name,
+        'name': name,
+        'started_at': datetime.now().isoformat(timespec='milliseconds'),
+        **attributes,
+    }
+    token = _current_span.set(record)
+    started = time.perf_counter()
+    record['status'] = 'ok'
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = 'error'
+        record['error'] = str(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        record['duration_s'] = round(time.perf_counter() - started, 3)
+        logging.info(f"[trace] {record['span']} {record['status']} in {record['duration_s']:.2f}s")
+        write_trace(record)
+
+def traced(name=None):
+    """Decorator that runs a function (sync or async) inside a span."""
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
 
-        with open(token_path, 'w') as token:
-            token.write(creds.to_json())
+def playwright_traces_enabled():
+    """Whether contexts record a Playwright trace that is saved when an activity fails."""
+    return os.getenv('PLAYWRIGHT_TRACE_ON_FAILURE', 'false').lower() in ('1', 'true', 'yes')
 
-    return creds
+def failure_trace_path(name):
+    """Where the Playwright trace of a failed activity is saved."""
+    return os.path.join(trace_dir, f"{name}-{RUN_ID}.zip")
+
+def save_failure_trace(context, name):
+    """Save the context's Playwright trace after a failure, if tracing is on."""
+    if not playwright_traces_enabled():
+        return
+    try:
+        os.makedirs(trace_dir, exist_ok=True)
+        context.tracing.stop(path=failure_trace_path(name))
+        logging.info(f"Saved Playwright trace to {failure_trace_path(name)}")
+    except Exception as e:
+        logging.warning(f"Could not save Playwright trace: {str(e)}")
 
 # ===========================
 # Browser Operations
 # ===========================
 
-def launch_browser(headless=True):
-    """Launch a fresh Chrome browser instance without persistent data using new headless mode."""
-    playwright = sync_playwright().start()
-    args = [
-        '--disable-dev-shm-usage',
-        '--no-sandbox',
-        '--disable-blink-features=AutomationControlled',
-        '--disable-infobars',
-        '--start-maximized',
-        '--incognito',
-    ]
+BROWSER_ARGS = [
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-blink-features=AutomationControlled',
+    '--disable-infobars',
+    '--start-maximized',
+    '--incognito',
+]
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36'
+VIEWPORT = {'width': 1440, 'height': 810}
+
+# Extra flags for the lean profile: no GPU, extensions or background services.
+LEAN_BROWSER_ARGS = [
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--no-first-run',
+    '--mute-audio',
+]
+
+# BROWSER_PROFILE selects one of these. 'chrome' is the installed Chrome at full size;
+# 'lean' is Playwright's bundled Chromium with a smaller viewport and resource filtering.
+BROWSER_PROFILES = {
+    'chrome': {
+        'channel': 'chrome',
+        'args': BROWSER_ARGS,
+        'viewport': VIEWPORT,
+        'filter_resources': False,
+    },
+    'lean': {
+        'channel': None,
+        'args': BROWSER_ARGS + LEAN_BROWSER_ARGS,
+        'viewport': {'width': 1280, 'height': 720},
+        'filter_resources': True,
+    },
+}
+
+def browser_profile():
+    """The launch profile named by BROWSER_PROFILE (default 'chrome')."""
+    return BROWSER_PROFILES[os.getenv('BROWSER_PROFILE', 'chrome')]
+
+def browser_channel():
+    """Browser channel to launch: the profile's, unless BROWSER_CHANNEL overrides it ('' for bundled Chromium)."""
+    channel = os.getenv('BROWSER_CHANNEL')
+    if channel is None:
+        channel = browser_profile()['channel']
+    return channel or None
+
+def _launch_chrome(playwright, headless=True):
+    """Start a Chrome process on the given Playwright driver."""
+    args = list(browser_profile()['args'])
     if headless:
         args.append('--headless=new')
-    
-    browser = playwright.chromium.launch(
-        channel="chrome",
+
+    return playwright.chromium.launch(
+        channel=browser_channel(),
         headless=False,  # Disable built-in headless to use the new flag instead.
         args=args,
         timeout=120000  # Increase browser launch timeout to 120 seconds
     )
-    
-    context = browser.new_context(
-        viewport={'width': 1440, 'height': 810},
-        user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
-        accept_downloads=True
+
+def _new_context(browser, storage_state=None):
+    """Create a fresh, isolated context with the profile's viewport and the standard user agent."""
+    return browser.new_context(
+        viewport=browser_profile()['viewport'],
+        user_agent=USER_AGENT,
+        accept_downloads=True,
+        storage_state=storage_state
     )
-    
+
+def launch_browser(headless=True):
+    """Launch a fresh Chrome browser instance without persistent data using new headless mode."""
+    from playwright.sync_api import sync_playwright
+    playwright = sync_playwright().start()
+    browser = _launch_chrome(playwright, headless)
+    context = _new_context(browser)
     page = context.new_page()
     
     return browser, playwright, page
 
-def wait_for_page_load(page, timeout=60000):
-    """Wait for page to be fully loaded."""
+# ===========================
+# Resource Filtering
+# ===========================
+
+# What each portal can do without. Requests to hosts other than the portal's own domain are
+# aborted unless listed in the portal's allowlist env var (comma-separated host names).
+# ECW keeps images because its toolbar buttons are images.
+PORTAL_RESOURCES = {
+    'ECW': {
+        'block_types': ('media', 'font'),
+        'allowed_hosts_env': 'ECW_ALLOWED_HOSTS',
+    },
+    'COMTEC': {
+        'block_types': ('image', 'media', 'font'),
+        'allowed_hosts_env': 'COMTEC_ALLOWED_HOSTS',
+    },
+}
+
+def resource_filter_enabled():
+    """Whether contexts abort non-essential requests: RESOURCE_FILTER, else the browser profile's default."""
+    setting = os.getenv('RESOURCE_FILTER')
+    if setting is None:
+        return browser_profile()['filter_resources']
+    return setting.lower() in ('1', 'true', 'yes')
+
+def allowed_hosts(system):
+    """Domains a portal may load from: its own (including subdomains) plus its allowlist."""
+    portal_host = urlparse(os.getenv(SESSION_SYSTEMS[system]['url_env']) or '').hostname or ''
+    # Keep the registrable part, so app.portal.com may load from static.portal.com
+    if portal_host and not portal_host.replace('.', '').isdigit():
+        portal_host = '.'.join(portal_host.split('.')[-2:])
+    hosts = {portal_host} if portal_host else set()
+    hosts.update(host.strip() for host in os.getenv(PORTAL_RESOURCES[system]['allowed_hosts_env'], '').split(',') if host.strip())
+    return hosts
+
+def should_block_request(system, resource_type, url, hosts):
+    """True for a request the portal's pages work without."""
+    if resource_type in PORTAL_RESOURCES[system]['block_types']:
+        return True
+    host = urlparse(url).hostname
+    if host is None or not hosts:
+        return False
+    return not any(host == allowed or host.endswith(f'.{allowed}') for allowed in hosts)
+
+def apply_resource_filter(context, system):
+    """Route every request of `context` through the portal's filter. Routing disables the HTTP cache."""
+    hosts = allowed_hosts(system)
+
+    def handle(route):
+        if should_block_request(system, route.request.resource_type, route.request.url, hosts):
+            route.abort()
+        else:
+            route.continue_()
+
+    context.route('**/*', handle)
+    logging.info(f"Filtering {system} resources (blocked types: {', '.join(PORTAL_RESOURCES[system]['block_types'])}; hosts: {', '.join(sorted(hosts)) or 'any'})")
+
+# ===========================
+# Browser Pool
+# ===========================
+
+# Sync Playwright objects are bound to the thread that created them, so each
+# thread keeps its own driver and Chrome processes.
+_browser_pool = threading.local()
+
+def _get_browser_pool():
+    """Return the pool state for the current thread."""
+    if not hasattr(_browser_pool, 'browsers'):
+        _browser_pool.playwright = None
+        _browser_pool.browsers = []
+    return _browser_pool
+
+def get_pooled_browser(headless=True, max_browsers=None):
+    """Return a warm Chrome process, launching one only when the pool has no free slot."""
+    pool = _get_browser_pool()
+    if pool.playwright is None:
+        from playwright.sync_api import sync_playwright
+        pool.playwright = sync_playwright().start()
+        logging.info("Started Playwright driver for browser pool")
+
+    if max_browsers is None:
+        max_browsers = int(os.getenv('BROWSER_POOL_SIZE', '1'))
+
+    pool.browsers = [browser for browser in pool.browsers if browser.is_connected()]
+    if pool.browsers:
+        browser = min(pool.browsers, key=lambda b: len(b.contexts))
+        if not browser.contexts or len(pool.browsers) >= max_browsers:
+            return browser
+
+    browser = _launch_chrome(pool.playwright, headless)
+    pool.browsers.append(browser)
+    logging.info(f"Launched pooled browser ({len(pool.browsers)}/{max_browsers})")
+    return browser
+
+def acquire_context(headless=True, system=None):
+    """Borrow a fresh isolated BrowserContext from the pool, preloaded with the saved session for `system`."""
+    storage_state = load_session_state(system) if system is not None else None
+    context = _new_context(get_pooled_browser(headless), storage_state=storage_state)
+    # Calls without an explicit timeout (clicks, fills) stop at the job's deadline too
+    context.set_default_timeout(capped_timeout(30000))
+    if system is not None and resource_filter_enabled():
+        apply_resource_filter(context, system)
+    if playwright_traces_enabled():
+        context.tracing.start(screenshots=True, snapshots=True)
+    return context
+
+def release_context(context):
+    """Return a borrowed context to the pool, discarding its cookies and pages."""
     try:
-        page.wait_for_load_state('domcontentloaded', timeout=timeout)
-        page.wait_for_load_state('networkidle', timeout=timeout)
-        page.wait_for_load_state('load', timeout=timeout)
-        logging.info("Page loaded successfully.")
+        context.close()
+    except Exception as e:
+        logging.warning(f"Failed to close browser context: {str(e)}")
+
+def close_browser_pool():
+    """Close every pooled browser and stop the Playwright driver for this thread."""
+    pool = _get_browser_pool()
+    for browser in pool.browsers:
+        try:
+            browser.close()
+        except Exception as e:
+            logging.warning(f"Failed to close pooled browser: {str(e)}")
+    pool.browsers = []
+    if pool.playwright is not None:
+        pool.playwright.stop()
+        pool.playwright = None
+        logging.info("Browser pool closed")
+
+@contextmanager
+def timed_wait(label):
+    """Log how long a wait actually took."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        logging.info(f"Wait for {label} took {time.perf_counter() - started:.2f}s")
+
+def wait_for_page_load(page, timeout=60000, state='load'):
+    """Wait for a single load state instead of chaining domcontentloaded, networkidle and load."""
+    timeout = capped_timeout(timeout)
+    try:
+        with timed_wait(f"page {state}"):
+            page.wait_for_load_state(state, timeout=timeout)
     except Exception as e:
         logging.warning(f"Wait for page load warning: {str(e)}")
 
 def wait_for_element(page, selector, timeout=60000):
-    """Wait for an element to be visible and stable."""
+    """Wait for an element to be visible."""
+    timeout = capped_timeout(timeout)
     try:
-        element = page.wait_for_selector(selector, timeout=timeout)
-        page.wait_for_timeout(1000)  # Small delay to ensure stability
-        logging.info(f"Element '{selector}' is visible.")
+        with timed_wait(f"element '{selector}'"):
+            element = page.wait_for_selector(selector, timeout=timeout)
         return element
     except Exception as e:
         logging.warning(f"Wait for element failed: {str(e)}")
         return None
 
-@retry_with_delay(attempts=5, delay=30)
+def wait_for_ready(page, target, timeout=60000, state='visible'):
+    """
+    Wait until the element that marks the next step as ready reaches `state`.
+    Args:
+        page: Playwright page object
+        target: CSS selector or Locator
+        timeout: Maximum wait in milliseconds
+        state: 'visible', 'attached', 'hidden' or 'detached'
+    """
+    locator = page.locator(target) if isinstance(target, str) else target
+    with timed_wait(f"{target if isinstance(target, str) else 'locator'} {state}"):
+        locator.first.wait_for(state=state, timeout=capped_timeout(timeout))
+
+def wait_for_response(page, url_pattern, action, timeout=60000):
+    """Run `action` and wait for the first response whose URL matches `url_pattern` (or that a predicate accepts)."""
+    with timed_wait(f"response {getattr(url_pattern, '__name__', url_pattern)}"):
+        with page.expect_response(url_pattern, timeout=capped_timeout(timeout)) as response_info:
+            action()
+    return response_info.value
+
+def wait_for_download(page, action, timeout=90000):
+    """Run `action` and wait for the download it triggers."""
+    with timed_wait("download"):
+        with page.expect_download(timeout=capped_timeout(timeout)) as download_info:
+            action()
+    return download_info.value
+
+@retrying('ui')
 def click_element(page, role, name, exact=True):
     """Click an element based on its role and name."""
     page.get_by_role(role, name=name, exact=exact).click()
 
 
+# ===========================
+# ECW Reports
+# ===========================
+
+# Dashboard reports, by the name of their download (<name>.csv). Each has the dashboard `link`
+# to open and, optionally:
+#   date_range:  custom date prompt running from a fixed start date to today (Chicago)
+#   incremental: with INCREMENTAL_EXTRACT, request only the days since the last loaded window
+#                (less `overlap_days`) and merge them into the stored history: rows whose
+#                `date_column` falls in the window are replaced, other rows matched on `key`
+#   keywords:    keyword filter whose matches are all added
+#   statuses:    status labels to select; they must match the listbox exactly
+#   fast_export: whether the recorded export request may be replayed (ECW_FAST_EXPORT)
+ECW_REPORTS = {
+    'daily_pro_orders': {
+        'link': 'Shortcut to Pro Orders with Ins RS',
+        'date_range': {'text_prompt': '0', 'start': '2024-06-01'},
+        'incremental': {
+            'key': os.getenv('PRO_ORDERS_MERGE_KEY', 'Account No,Order Date,Order').split(','),
+            'date_column': os.getenv('PRO_ORDERS_DATE_COLUMN', 'Order Date'),
+            'overlap_days': int(os.getenv('PRO_ORDERS_OVERLAP_DAYS', '7')),
+        },
+        'keywords': 'ord',
+        'statuses': [
+            "", "*Auth Denied", "*Auth Submitted", "*Declined", "*Done", "*Duplicate",
+            "*Info updated", "*Lock Note", "*Missing Info", "*Peer to Peer",
+            "*Pending Auth", "*Pending Estimate", "*PT/Imaging Needed",
+            "*Ready to Schedule", "*Ready To Schedule BT", "*Ready To Schedule PC",
+        ],
+    },
+    'dme_orders': {
+        'link': 'Report View of 4.14 - Next Day Appointments',
+        'fast_export': True,
+    },
+}
+
+def ecw_batch_enabled():
+    """Whether the ECW reports run as one job in a single login session."""
+    return os.getenv('ECW_BATCH_SESSION', 'false').lower() in ('1', 'true', 'yes')
+
+def ecw_report_window(name):
+    """The (start, end) dates a report's date prompt asks for: its delta when incremental, else its full range."""
+    report = ECW_REPORTS[name]
+    from run_state import incremental_enabled, incremental_window
+    first = date.fromisoformat(report['date_range']['start'])
+    if report.get('incremental') and incremental_enabled():
+        return incremental_window(name, first, report['incremental']['overlap_days'])
+    return first, chicago_today()
+
+def ecw_parallel_tabs():
+    """How many ECW reports a session may run at once, each in its own tab (async runs only)."""
+    return max(1, int(os.getenv('ECW_PARALLEL_TABS', '1')))
+
+# Adds every option whose trimmed label equals a wanted label to the selection, then fires the
+# events a user's selection would. Returns the wanted labels that have no option.
+SELECT_LABELS_SCRIPT = """(select, labels) => {
+    const wanted = new Set(labels.map(label => label.trim()));
+    const found = new Set();
+    for (const option of select.options) {
+        const label = option.label.trim();
+        if (wanted.has(label)) {
+            option.selected = true;
+            found.add(label);
+        }
+    }
+    select.dispatchEvent(new Event('input', {bubbles: true}));
+    select.dispatchEvent(new Event('change', {bubbles: true}));
+    return labels.filter(label => !found.has(label.trim()));
+}"""
+
+def select_options_by_label(listbox, labels):
+    """
+    Add the options with exactly these labels to a select[multiple]'s selection in one round-trip.
+    Args:
+        listbox: Locator of the select element
+        labels: Option labels to select (compared after trimming whitespace)
+    Returns:
+        The labels that were not found in the listbox
+    """
+    missing = listbox.evaluate(SELECT_LABELS_SCRIPT, list(labels))
+    if missing:
+        logging.warning(f"Options not found in listbox: {', '.join(repr(label) for label in missing)}")
+    return missing
+
+# ===========================
+# Session Cache
+# ===========================
+
+SESSION_SYSTEMS = {
+    'ECW': {
+        'url_env': 'ECW_URL',
+        'username_env': 'ECW_USERNAME',
+        'password_env': 'ECW_PASSWORD',
+        'username_selector': 'input#username',
+        'password_selector': 'input#password',
+        'login_button': 'Login',
+        'ready_selector': 'a:has-text("Dashboard")',
+    },
+    'COMTEC': {
+        'url_env': 'COMTEC_URL',
+        'username_env': 'COMTEC_USERNAME',
+        'password_env': 'COMTEC_PASSWORD',
+        'username_selector': 'input[placeholder="Login Name"]',
+        'password_selector': 'input[placeholder="Password"]',
+        'login_button': 'Log In',
+        'ready_selector': 'a:has-text("Call Center"), [href*="call-center"], [data-module="call-center"]',
+    },
+}
+
+def session_state_path(system):
+    """Path of the saved Playwright storage_state for a system."""
+    return os.path.join(config_dir, f'{system.lower()}_storage_state.json')
+
+def persist_sessions():
+    """Whether sessions are kept alive for reuse instead of being logged off."""
+    return os.getenv('PERSIST_SESSIONS', 'true').lower() in ('1', 'true', 'yes')
+
+def write_session_state(system, state):
+    """Atomically replace a system's saved session, so a concurrent reader never sees a partial file."""
+    path = session_state_path(system)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(temp_path, path)
+    logging.info(f"Saved {system} session to {path}")
+
+def load_session_state(system):
+    """The saved session for a system, or None when there is none or it cannot be read."""
+    try:
+        with open(session_state_path(system)) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Saved {system} session is unreadable, logging in fresh: {str(e)}")
+        clear_session(system)
+        return None
+
+def save_session(context, system):
+    """Save the context's cookies and local storage for the next run."""
+    write_session_state(system, context.storage_state())
+
+def clear_session(system):
+    """Forget the saved session for a system."""
+    try:
+        os.remove(session_state_path(system))
+        logging.info(f"Cleared saved {system} session")
+    except FileNotFoundError:
+        pass
+
+def session_probe(page, system, timeout=15000):
+    """Return True when the portal shows the logged-in view instead of the login form."""
+    config = SESSION_SYSTEMS[system]
+    try:
+        page.locator(f"{config['username_selector']}, {config['ready_selector']}").first.wait_for(state='visible', timeout=timeout)
+        return page.locator(config['ready_selector']).first.is_visible()
+    except Exception as e:
+        logging.warning(f"Session probe for {system} failed: {str(e)}")
+        return False
+
+@traced('login')
+def login_with_session(page, system):
+    """Open the portal and log in, reusing the saved session when it is still valid."""
+    from run_state import checkpoint_stage
+    config = SESSION_SYSTEMS[system]
+    page.goto(os.getenv(config['url_env']))
+    wait_for_page_load(page, state='domcontentloaded')
+
+    if session_probe(page, system):
+        logging.info(f"Reused saved {system} session")
+        checkpoint_stage('login', system=system, reused=True)
+        return
+
+    logging.info(f"Saved {system} session missing or expired, logging in")
+    fill_with_delay(page, config['username_selector'], os.getenv(config['username_env']))
+    fill_with_delay(page, config['password_selector'], os.getenv(config['password_env']))
+    page.get_by_role("button", name=config['login_button']).click()
+    page.locator(config['ready_selector']).first.wait_for(state='visible', timeout=60000)
+    logging.info(f"Logged in to {system} successfully")
+    checkpoint_stage('login', system=system, reused=False)
+
+    if persist_sessions():
+        save_session(page.context, system)
+
+
 # ===========================
 # Data Transformation
 # ===========================
 
 def transform_dataframe(df):
     """Transform the DataFrame to extract transaction totals and summaries."""
-    transaction_totals_str = df.iloc[0, 0]
-    transaction_totals = {}
-    
-    try:
-        matches = re.findall(r'(\w+): (\d+)', transaction_totals_str)
-        transaction_totals = {key: value for key, value in matches}
-    except Exception as e:
-        print(f"Error parsing transaction totals: {e}")
-        return None
-    
-    new_data = {
-        'Transaction Totals:': [f"Visa: {transaction_totals.get('Visa', '0')}", 
-                                f"MasterCard: {transaction_totals.get('MasterCard', '0')}", 
-                                f"American Express: {transaction_totals.get('American', '0')}", 
-                                f"Discover: {transaction_totals.get('Discover', '0')}", 
-                                f"Apple Pay: {transaction_totals.get('Apple', '0')}", 
-                                f"ACH (eCheck): {transaction_totals.get('ACH', '0')}"],
-        'Sales Summary': df.iloc[3:9, 0].fillna('').values,
-        'Declined Summary': df.iloc[3:9, 4].fillna('').values,
-        'Credit Summary': df.iloc[3:9, 8].fillna('').values,
-        'Net Total': df.iloc[3:9, 12].fillna('').values
-    }
-    
-    new_df = pd.DataFrame(new_data)
-    
-    total_row = pd.DataFrame({
-        'Transaction Totals:': [f"Total sales: {df.iloc[9, 0].split(': ')[1]}"],
-        'Sales Summary': [f"Total sales: {df.iloc[9, 0].split(': ')[1]}"],
-        'Declined Summary': [f"Total declined: {df.iloc[9, 4].split(': ')[1]}"],
-        'Credit Summary': [f"Total credit: {df.iloc[9, 8].split(': ')[1]}"],
-        'Net Total': [f"Total net: {df.iloc[9, 12].split(': ')[1]}"]
-    })
-    
-    new_df = pd.concat([new_df, total_row], ignore_index=True)
-    
-    return new_df
+    from transforms import transform_report
+    return transform_report(df, 'payment_summary')
 
 # ===========================
 # Report Downloading
 # ===========================
 
+@traced('download')
 def change_report_format_and_download(page, download_dir, file_name):
     """Change report format and download the report."""
     logging.info("Attempting to change report format and download")
@@ -218,15 +785,96 @@ def change_report_format_and_download(page, download_dir, file_name):
     page.get_by_label("Change report format").click()
     page.get_by_role("cell", name="View in Excel Options View in").click()
 
-    with page.expect_download(timeout=90000) as download_info:
-        page.get_by_role("cell", name="View in CSV Format View in").click()
-
-    download = download_info.value
+    # Record the export request so later runs can replay it without the UI
+    export_requests = []
+    on_request = lambda request: export_requests.append(request)
+    page.on("request", on_request)
+    try:
+        download = wait_for_download(page, page.get_by_role("cell", name="View in CSV Format View in").click, timeout=90000)
+    finally:
+        page.remove_listener("request", on_request)
     save_path = os.path.join(download_dir, f"{file_name}.csv")
     download.save_as(save_path)
+    save_export_recipe(file_name, download.url, export_requests)
 
     logging.info("Report downloaded successfully")
 
+# ===========================
+# Direct Report Export
+# ===========================
+
+# Headers the browser context sets itself when replaying a request.
+REPLAY_SKIP_HEADERS = {'cookie', 'content-length', 'host'}
+
+def export_recipe_path(file_name):
+    """Path of the recorded export request for a report."""
+    return os.path.join(config_dir, f'{file_name}_export.json')
+
+def fast_export_enabled():
+    """Whether reports may be fetched by replaying their recorded export request."""
+    return os.getenv('ECW_FAST_EXPORT', 'false').lower() in ('1', 'true', 'yes')
+
+def save_export_recipe(file_name, download_url, requests):
+    """Save the request that produced a download so it can be replayed over HTTP."""
+    export_request = next((request for request in reversed(requests) if request.url == download_url), None)
+    if export_request is None:
+        logging.info(f"No export request matched {download_url}; nothing recorded for {file_name}")
+        return
+
+    recipe = {
+        'url': export_request.url,
+        'method': export_request.method,
+        'post_data': export_request.post_data,
+        'headers': {name: value for name, value in export_request.headers.items() if name.lower() not in REPLAY_SKIP_HEADERS},
+    }
+    with open(export_recipe_path(file_name), 'w') as recipe_file:
+        json.dump(recipe, recipe_file, indent=2)
+    logging.info(f"Recorded export request for {file_name}")
+
+def load_export_recipe(file_name):
+    """Load the recorded export request for a report, or None if there is none."""
+    if not os.path.exists(export_recipe_path(file_name)):
+        return None
+    with open(export_recipe_path(file_name)) as recipe_file:
+        return json.load(recipe_file)
+
+def is_report_export(status, content_type, body):
+    """Reject error pages and login redirects returned instead of the CSV."""
+    return 200 <= status < 300 and bool(body) and 'text/html' not in content_type and not body.lstrip().startswith(b'<')
+
+@traced('direct_export')
+def replay_report_export(context, download_dir, file_name, timeout=90000):
+    """
+    Fetch a report by replaying its recorded export request with the context's session cookies.
+    Returns:
+        True when the CSV was saved, False when the caller should fall back to the UI flow
+    """
+    recipe = load_export_recipe(file_name)
+    if recipe is None:
+        return False
+
+    try:
+        with timed_wait(f"direct export of {file_name}"):
+            response = context.request.fetch(
+                recipe['url'],
+                method=recipe['method'],
+                headers=recipe['headers'],
+                data=recipe['post_data'],
+                timeout=timeout
+            )
+            body = response.body()
+        if not is_report_export(response.status, response.headers.get('content-type', ''), body):
+            logging.warning(f"Direct export of {file_name} returned an unexpected response ({response.status}), using UI flow")
+            return False
+    except Exception as e:
+        logging.warning(f"Direct export of {file_name} failed, using UI flow: {str(e)}")
+        return False
+
+    with open(os.path.join(download_dir, f"{file_name}.csv"), 'wb') as report_file:
+        report_file.write(body)
+    logging.info(f"Report {file_name} downloaded via direct export")
+    return True
+
 def download_comtec_report(page, download_dir, file_name='comtec_export.csv'):
     """
     Download the Comtec report.
@@ -239,30 +887,134 @@ def download_comtec_report(page, download_dir, file_name='comtec_export.csv'):
 
     export_button = page.get_by_role("button", name="Export")
     export_button.wait_for(state='visible', timeout=10000)
-    export_button.click()
 
     logging.info("Waiting for download to complete...")
 
-    with page.expect_download() as download_info:
-        page.wait_for_timeout(1000)  
-    download = download_info.value
+    download = wait_for_download(page, export_button.click)
     save_path = os.path.join(download_dir, file_name)
     download.save_as(save_path)
 
     logging.info(f"File downloaded successfully as {file_name}")
-    
-    
+
+
+# ===========================
+# Statistics Capture
+# ===========================
+
+# The Comtec Reports modal fetches each statistic as JSON before offering the CSV download.
+# Capture mode reads those responses instead of downloading the file. The default pattern matches
+# a /stats or /statistics path segment, not /status or /static.
+STATISTIC_RESPONSE_PATTERN = re.compile(os.getenv('COMTEC_STATS_RESPONSE_PATTERN', r'/stat(istic)?s(/|\?|$)'), re.IGNORECASE)
+# Where the rows sit in a statistics payload, and where explicit column names sit when rows are lists
+STATISTIC_ROW_KEYS = ('data', 'rows', 'stats', 'statistics', 'records', 'items', 'result')
+STATISTIC_HEADER_KEYS = ('columns', 'headers', 'fields')
+
+def capture_statistics_enabled():
+    """Whether Comtec statistics are captured from the page's responses instead of downloaded."""
+    return os.getenv('COMTEC_CAPTURE', 'false').lower() in ('1', 'true', 'yes')
+
+def comtec_stat_types():
+    """
+    The statistics to collect in capture mode and the tab each one uploads to, from
+    COMTEC_STAT_TYPES, e.g. 'abandoned:Data,answered:Answered'. A type without a tab uploads to a tab of its own name.
+    """
+    stat_types = {}
+    for entry in os.getenv('COMTEC_STAT_TYPES', 'abandoned:Data').split(','):
+        stat_type, _, tab = entry.strip().partition(':')
+        if stat_type:
+            stat_types[stat_type] = tab.strip() or stat_type
+    return stat_types
+
+def is_statistic_response(response, stat_type):
+    """A successful JSON response from a statistics endpoint whose request asked for `stat_type`."""
+    return (200 <= response.status < 300
+            and 'json' in response.headers.get('content-type', '')
+            and bool(STATISTIC_RESPONSE_PATTERN.search(response.url))
+            and response_stat_type(response.url, response.request.post_data) == stat_type)
+
+def response_stat_type(url, post_data=None):
+    """The stat_type a statistics request asked for, from its query string or form/JSON body, or None."""
+    params = parse_qs(urlparse(url).query)
+    if post_data:
+        try:
+            body = json.loads(post_data)
+            if isinstance(body, dict) and body.get('stat_type'):
+                return str(body['stat_type'])
+        except ValueError:
+            params.update(parse_qs(post_data))
+    return (params.get('stat_type') or [None])[0]
+
+def _statistic_cell(value):
+    """Sheets-ready cell: numbers and text as they are, nested values as JSON, null as blank."""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+def statistic_rows(payload):
+    """
+    Turn a statistics payload into rows, header first.
+    Accepts a list of records, a list of rows whose first row is the header, or an object holding
+    either under one of STATISTIC_ROW_KEYS (with column names under STATISTIC_HEADER_KEYS when rows are lists).
+    """
+    header = None
+    records = payload
+    if isinstance(payload, dict):
+        records = next((payload[key] for key in STATISTIC_ROW_KEYS if isinstance(payload.get(key), list)), None)
+        columns = next((payload[key] for key in STATISTIC_HEADER_KEYS if isinstance(payload.get(key), list)), None)
+        if columns is not None:
+            header = [column.get('name') or column.get('title') or column.get('label') if isinstance(column, dict) else column
+                      for column in columns]
+    if not isinstance(records, list):
+        raise ValueError(f"Unrecognised statistics payload: {str(payload)[:200]}")
+
+    if records and all(isinstance(record, dict) for record in records):
+        header = list(dict.fromkeys(key for record in records for key in record))
+        body = [[record.get(name) for name in header] for record in records]
+    elif header is None:
+        header, body = (records[0], records[1:]) if records else ([], [])
+    else:
+        body = records
+
+    return [[str(name) for name in header]] + [[_statistic_cell(value) for value in row] for row in body]
+
+def rows_digest(rows):
+    """blake2b digest of captured rows, comparable across runs like file_digest."""
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        digest.update(json.dumps(row, default=str).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+def capture_statistic(page, stat_type, action, timeout=60000):
+    """
+    Run `action` (the search click) and read the statistics response it triggers for `stat_type`.
+    Returns:
+        rows, header first
+    """
+    def statistics_response(response):
+        return is_statistic_response(response, stat_type)
+
+    response = wait_for_response(page, statistics_response, action, timeout=timeout)
+    rows = statistic_rows(response.json())
+    logging.info(f"Captured {len(rows) - 1} {stat_type} rows from {response.url}")
+    return rows
+
+
 # ===========================
 # Date and Time Utilities
 # ===========================
 
+def chicago_today():
+    """Today's date in the Chicago timezone."""
+    import pytz
+    return datetime.now(pytz.timezone('America/Chicago')).date()
+
 def calculate_dates():
     """Calculate the current date in Chicago timezone and return the abbreviated month name."""
-    chicago_tz = pytz.timezone('America/Chicago')
-    month = datetime.now(chicago_tz).strftime('%b')
-    day = datetime.now(chicago_tz).day
-    today = month, day
-    return today
+    today = chicago_today()  # read the clock once, so month and day cannot straddle midnight
+    return today.strftime('%b'), today.day
 
 def calculate_weekly_dates():
     """Calculate the start and end dates for the current week (Saturday to Friday)."""
@@ -307,6 +1059,7 @@ def call_on_fridays(function):
 
 def daily_call_date_range():
     """Get the date range based on current day and time in EST."""
+    import pytz
     est = pytz.timezone('America/New_York')
     now = datetime.now(est)
     weekday = now.weekday()  # 0=Monday through 6=Sunday
@@ -355,15 +1108,3 @@ def fill_with_delay(page, selector, text, delay=50):
     """Type text into an element with a delay between each character."""
     for char in text:
         page.locator(selector).type(char, delay=delay)
-
-def retry_operation(operation, attempts=5, delay=60, *args, **kwargs):
-    """Retries a given operation with a specified delay between attempts."""
-    for attempt in range(attempts):
-        try:
-            return operation(*args, **kwargs)
-        except Exception as e:
-            logging.error(f"Attempt {attempt + 1} failed: {e}")
-            if attempt < attempts - 1:
-                logging.info(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-    raise Exception(f"All {attempts} attempts failed.")
\ No newline at end of file
@@ -0,0 +1,182 @@
+import csv
+import codecs
+import logging
+
+# pyarrow is optional (the pandas C parser / csv module are the fallback) and, like pandas,
+# only imported once a report is actually parsed.
+_arrow = None
+
+
+def arrow():
+    """Return (pyarrow, pyarrow.csv), or (None, None) when pyarrow is not installed."""
+    global _arrow
+    if _arrow is None:
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+            _arrow = (pa, pa_csv)
+        except ImportError:
+            _arrow = (None, None)
+    return _arrow
+
+
+# ===========================
+# Encoding and Delimiter Sniffing
+# ===========================
+
+SNIFF_BYTES = 64 * 1024
+DELIMITERS = ['\t', ',', ';', '|']
+
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def sniff_encoding(path):
+    """Detect a report's encoding from its BOM, NUL-byte pattern or a UTF-8 trial decode."""
+    with open(path, 'rb') as file:
+        sample = file.read(SNIFF_BYTES)
+
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    # UTF-16 without a BOM: ASCII text leaves every other byte NUL
+    if sample[1::2].count(0) > len(sample) // 4:
+        return 'utf-16-le'
+    if sample[0::2].count(0) > len(sample) // 4:
+        return 'utf-16-be'
+
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut at the end of the sample is still UTF-8
+        if e.start < len(sample) - 3:
+            return 'cp1252'
+    return 'utf-8'
+
+
+def sniff_delimiter(path, encoding):
+    """Pick the delimiter that splits the header line into the most columns."""
+    with open(path, 'r', encoding=encoding, newline='') as file:
+        header = file.readline()
+    return max(DELIMITERS, key=header.count) if any(d in header for d in DELIMITERS) else ','
+
+
+def sniff_format(path, encoding=None, delimiter=None):
+    """Fill in whichever of encoding/delimiter was not given."""
+    encoding = encoding or sniff_encoding(path)
+    delimiter = delimiter or sniff_delimiter(path, encoding)
+    return encoding, delimiter
+
+
+# ===========================
+# Fast Parsing
+# ===========================
+
+def read_header(path, encoding, delimiter):
+    """Return the header row of a report."""
+    with open(path, 'r', encoding=encoding, newline='') as file:
+        return next(csv.reader(file, delimiter=delimiter), [])
+
+
+def _arrow_options(header, encoding, delimiter, block_size=None):
+    """pyarrow CSV options that read every column as a non-null string, header skipped."""
+    pa, pa_csv = arrow()
+    read_options = pa_csv.ReadOptions(
+        encoding=encoding,
+        skip_rows=1,
+        autogenerate_column_names=True,
+        **({'block_size': block_size} if block_size else {})
+    )
+    parse_options = pa_csv.ParseOptions(delimiter=delimiter, newlines_in_values=True)
+    convert_options = pa_csv.ConvertOptions(
+        column_types={f'f{index}': pa.string() for index in range(len(header))},
+        strings_can_be_null=False,
+        quoted_strings_can_be_null=False,
+    )
+    return {'read_options': read_options, 'parse_options': parse_options, 'convert_options': convert_options}
+
+
+def _fit_row(row, width):
+    """Pad a short row with blanks and cut a long one to `width` cells."""
+    return row[:width] + [''] * (width - len(row))
+
+
+def read_table(path, encoding=None, delimiter=None):
+    """
+    Read a report into a DataFrame of strings, sniffing the encoding and delimiter when not given.
+    Uses pyarrow's multithreaded parser over a memory map, falling back to the pandas C parser and,
+    for ragged rows neither accepts, to csv.reader with each row fitted to the header. Every path
+    keeps the header exactly as written, repeated names included.
+    """
+    import pandas as pd
+    pa, pa_csv = arrow()
+    encoding, delimiter = sniff_format(path, encoding, delimiter)
+    header = read_header(path, encoding, delimiter)
+
+    if pa_csv is not None:
+        try:
+            table = pa_csv.read_csv(pa.memory_map(path), **_arrow_options(header, encoding, delimiter))
+            df = table.to_pandas()
+            df.columns = header
+            return df
+        except Exception as e:
+            logging.warning(f"pyarrow could not parse {path}, using pandas: {e}")
+
+    try:
+        df = pd.read_csv(path, encoding=encoding, sep=delimiter, dtype=str, keep_default_na=False, engine='c',
+                         memory_map=True, header=None, skiprows=1, names=range(len(header)))
+        df.columns = header
+        return df.fillna('')
+    except pd.errors.ParserError as e:
+        logging.warning(f"pandas could not parse {path}, using csv module: {e}")
+
+    with open(path, 'r', encoding=encoding, newline='') as file:
+        reader = csv.reader(file, delimiter=delimiter)
+        next(reader, None)
+        rows = [row for row in reader if row]
+    ragged = sum(len(row) != len(header) for row in rows)
+    if ragged:
+        logging.warning(f"{path}: fitted {ragged} row(s) with the wrong number of cells to the {len(header)}-column header")
+    df = pd.DataFrame([_fit_row(row, len(header)) for row in rows], columns=range(len(header)), dtype=str)
+    df.columns = header
+    return df
+
+
+def iter_rows(path, encoding=None, delimiter=None, block_size=1 << 20):
+    """
+    Yield the header and then each row of a report as a list of strings, without materializing the file.
+    Rows come from pyarrow record batches when available, otherwise from csv.reader. A row pyarrow
+    rejects mid-stream (e.g. a ragged row) hands the rest of the file to csv.reader, which keeps it as is.
+    """
+    pa, pa_csv = arrow()
+    encoding, delimiter = sniff_format(path, encoding, delimiter)
+    header = read_header(path, encoding, delimiter)
+    yield header
+
+    yielded = 0
+    if pa_csv is not None:
+        try:
+            reader = pa_csv.open_csv(pa.memory_map(path), **_arrow_options(header, encoding, delimiter, block_size))
+            for batch in reader:
+                columns = [column.to_pylist() for column in batch.columns]
+                for row in zip(*columns):
+                    yield list(row)
+                yielded += batch.num_rows
+            return
+        except Exception as e:
+            logging.warning(f"pyarrow could not stream {path} past row {yielded}, using csv module: {e}")
+
+    with open(path, 'r', encoding=encoding, newline='') as file:
+        reader = csv.reader(file, delimiter=delimiter)
+        next(reader, None)
+        # Skip the rows pyarrow already yielded (it drops blank lines, so they don't count)
+        skipped = 0
+        for row in reader:
+            if skipped < yielded:
+                skipped += bool(row)
+                continue
+            yield row
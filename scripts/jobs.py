@@ -0,0 +1,500 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+import logging
+from helper import (ECW_REPORTS, capture_statistics_enabled, close_browser_pool, comtec_stat_types,
+                    daily_call_date_range, download_dir, ecw_batch_enabled, job_deadline, JobTimeout,
+                    rows_digest, span)
+from activity import (comtec_call_statistics, daily_call_comtech_report, daily_pro_orders, dme_orders,
+                      ecw_report_session, google_rows_upload)
+from run_state import (file_digest, start_run_manifest, finish_run_manifest, job_checkpoints, checkpoint_stage,
+                       checkpointed_stage, upload_stage, incremental_enabled, pending_window, commit_window)
+from ingest import iter_rows
+from report_store import store_report, load_latest_run, load_merged_history, merge_report_history
+
+
+# ===========================
+# Job Runner
+# ===========================
+
+# Maximum number of parallel browser sessions per portal.
+# ECW defaults to one: run_jobs gives each session its own lane thread, and the browser pool is
+# per thread, so a second lane means a second Playwright driver and cold Chrome launch per run.
+# With one lane the ECW jobs run back to back on one warm browser and reuse the saved login.
+# Raise ECW_MAX_SESSIONS to overlap the ECW reports when their wall time matters more than the
+# extra launch (in async runs the sessions share one browser, so there it only costs a context).
+SYSTEM_CONCURRENCY = {
+    'ECW': int(os.getenv('ECW_MAX_SESSIONS', '1')),
+    'COMTEC': int(os.getenv('COMTEC_MAX_SESSIONS', '1')),
+}
+DEFAULT_JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', '900'))  # seconds
+# How long run_jobs keeps waiting for a lane past its jobs' timeouts (a single Playwright call
+# with its own long timeout can outlast the job deadline) before giving up on it.
+LANE_GRACE = int(os.getenv('LANE_GRACE', '300'))  # seconds
+
+
+def run_job(job, manifest=None):
+    """
+    Run a single job: the activity, then every upload target for its download.
+    With a run manifest, stages checkpointed by an earlier attempt are skipped.
+    Args:
+        job: dict with name, system, activity, download, uploads and optional
+             encoding and delimiter (detected from the file when omitted), sync ('full' or 'diff'), transform (a
+             transforms.REPORT_SPECS key), timeout (seconds), window (returns the scheduled window the
+             download covers; a checkpointed download is only reused within the same window) and incremental
+             (an ECW_REPORTS incremental definition: the download is merged into the stored history before uploading).
+             Capture jobs also have `capture` (returns stat_type -> rows), `stat_uploads` (stat_type -> targets)
+             and optional `stat_transforms` (stat_type -> REPORT_SPECS key); their rows never touch the disk.
+             Batch jobs have `parts` (name -> job dict with download, uploads, ...) and an activity that takes
+             the names of the parts to download and returns {name: error or None}; every part that downloads
+             is uploaded even if others fail, and a failed part's own error is reported in the job result.
+        manifest: optional run manifest from start_run_manifest
+    Returns:
+        dict with name, status, duration and error
+    """
+    started = time.time()
+    timeout = job.get('timeout', DEFAULT_JOB_TIMEOUT)
+    result = {'name': job['name'], 'status': 'ok', 'duration': 0.0, 'error': None}
+    try:
+        with span('job', job=job['name']), job_checkpoints(manifest, job['name']):
+            logging.info(f"Job '{job['name']}' started")
+            captured = failed = None
+            # The browser work gets `timeout` seconds (see helper.job_deadline); whatever it
+            # finished in time is uploaded, however long the uploads then take.
+            with job_deadline(timeout):
+                if job.get('capture'):
+                    # Rows are only held in memory, so a resumed capture job captures again
+                    captured = job['capture'](list(job['stat_uploads']))
+                elif job.get('parts'):
+                    pending = _pending_parts(job)
+                    errors = job['activity'](pending) if pending else {}
+                    failed = _check_parts(job, pending, started, errors)
+                elif _download_checkpointed(job):
+                    logging.info(f"Job '{job['name']}': download already checkpointed, skipping the activity")
+                else:
+                    job['activity']()
+                    _check_download(job, started)
+                    _checkpoint_download(job)
+
+            if captured is not None:
+                _upload_captured(job, captured)
+            elif failed is not None:
+                _upload_parts(job, failed)
+            else:
+                _upload_job(job)
+    except JobTimeout as e:
+        result['status'] = 'timeout'
+        result['error'] = f"{e}, skipping uploads"
+        logging.error(f"Job '{job['name']}': {result['error']}")
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+        logging.error(f"Job '{job['name']}' failed: {e}")
+    finally:
+        result['duration'] = round(time.time() - started, 1)
+    return result
+
+
+def _check_download(job, started):
+    """Fail the job when its download is missing or was not refreshed by this run."""
+    download = job.get('download')
+    if download and (not os.path.exists(download) or os.path.getmtime(download) < started):
+        raise RuntimeError(f"Download {download} missing or stale, skipping uploads")
+
+
+def _job_window(job):
+    """The scheduled window a job's download covers (see the `window` job key), as stored in checkpoints."""
+    return list(job['window']()) if job.get('window') else None
+
+
+def _checkpoint_download(job, stage='download'):
+    """Record the job's download, with its digest and window, in the run manifest."""
+    if job.get('download'):
+        checkpoint_stage(stage, path=job['download'], digest=file_digest(job['download']), window=_job_window(job))
+
+
+def _download_checkpointed(job, stage='download'):
+    """
+    True when an earlier attempt downloaded this job's file for the current window and it is still
+    unchanged on disk. A rerun in a later window (e.g. the 3 pm call report after a failed 11 am
+    upload) scrapes again instead of re-uploading the old file.
+    """
+    record = checkpointed_stage(stage)
+    download = job.get('download')
+    return bool(record and download and os.path.exists(download)
+                and record.get('window') == _job_window(job) and file_digest(download) == record['digest'])
+
+
+def _pending_parts(job):
+    """Names of a batch job's parts without a checkpointed download."""
+    pending = []
+    for name, part in job['parts'].items():
+        if _download_checkpointed(part, f'download:{name}'):
+            logging.info(f"Job '{job['name']}': {name} download already checkpointed, skipping it")
+        else:
+            pending.append(name)
+    return pending
+
+
+def _check_parts(job, pending, started, errors):
+    """
+    Check and checkpoint the downloads of the parts that just ran.
+    Returns {name: error} for those that failed, keeping the activity's own error (from `errors`) when it reported one.
+    """
+    failed = {}
+    for name in pending:
+        if errors.get(name):
+            failed[name] = errors[name]
+            continue
+        try:
+            _check_download(job['parts'][name], started)
+            _checkpoint_download(job['parts'][name], f'download:{name}')
+        except Exception as e:
+            logging.error(f"Job '{job['name']}': {name} failed: {e}")
+            failed[name] = str(e)
+    return failed
+
+
+def _upload_parts(job, failed):
+    """Upload every part whose download succeeded, then fail the job if any part failed."""
+    for name, part in job['parts'].items():
+        if name in failed:
+            continue
+        try:
+            _upload_job(part, store_stage=f'store:{name}')
+        except Exception as e:
+            logging.error(f"Job '{job['name']}': {name} upload failed: {e}")
+            failed[name] = str(e)
+    if failed:
+        raise RuntimeError('; '.join(f"{name}: {error}" for name, error in failed.items()))
+
+
+def _pending_uploads(job, uploads, digest):
+    """Upload targets not yet checkpointed for this exact content."""
+    pending = []
+    for spreadsheet_id, sheet_name in uploads:
+        record = checkpointed_stage(upload_stage(spreadsheet_id, sheet_name))
+        if record and record.get('digest') == digest:
+            logging.info(f"Job '{job['name']}': upload to '{sheet_name}' already checkpointed, skipping")
+        else:
+            pending.append((spreadsheet_id, sheet_name))
+    return pending
+
+
+def _upload_job(job, store_stage='store'):
+    """Store the job's download and upload it to every (spreadsheet_id, sheet_name) target in one pass."""
+    from transforms import read_report
+    path, encoding, delimiter = job['download'], job.get('encoding'), job.get('delimiter')
+    _upload_report(
+        job, job.get('uploads') or [], job.get('transform'), file_digest(path),
+        table=lambda: read_report(path, encoding=encoding, delimiter=delimiter),
+        rows=lambda: iter_rows(path, encoding=encoding, delimiter=delimiter),
+        store_stage=store_stage,
+    )
+    if job.get('incremental'):
+        commit_window(job['report'])
+
+
+def _upload_captured(job, captured):
+    """Store and upload each captured statistic to its own targets, straight from memory."""
+    from transforms import rows_report
+    for stat_type, rows in captured.items():
+        _upload_report(
+            job, job['stat_uploads'].get(stat_type, []), job.get('stat_transforms', {}).get(stat_type), rows_digest(rows),
+            table=lambda rows=rows: rows_report(rows),
+            rows=lambda rows=rows: iter(rows),
+            store_stage=f'store:{stat_type}',
+        )
+
+
+def _upload_report(job, uploads, report, digest, table, rows, store_stage='store'):
+    """
+    Store one report and upload it to its targets.
+    `table` loads it as a raw DataFrame (when it has a `report` transform), `rows` as plain rows.
+    Failures propagate to the job result; only targets that finished are checkpointed.
+    """
+    from transforms import transform_report, dataframe_rows
+    uploads = _pending_uploads(job, uploads, digest)
+    stored = checkpointed_stage(store_stage)
+    store_pending = bool(report) and not (stored and stored.get('digest') == digest)
+    if not uploads and not store_pending:
+        return
+
+    if report:
+        # Typed and cleaned in one pass
+        with span('parse'):
+            df = transform_report(table(), report)
+        # Keep history before uploading, so a failed upload can be replayed without re-scraping
+        if store_pending:
+            try:
+                checkpoint_stage(store_stage, path=store_report(df, report), digest=digest)
+            except Exception as e:
+                logging.warning(f"Could not store {report} history: {e}")
+        incremental = job.get('incremental')
+        if incremental:
+            # An incremental download only holds its window; the upload is the whole merged history.
+            # Merging the same window again on a resume gives the same table.
+            window = pending_window(job['report'])
+            if window is None:
+                raise RuntimeError(f"No requested window recorded for {job['report']}, cannot merge it")
+            with span('merge'):
+                df = merge_report_history(df, report, incremental['key'], incremental['date_column'], window)
+        values = dataframe_rows(df)
+    else:
+        values = rows()
+
+    if uploads:
+        google_rows_upload(values, uploads, sync=job.get('sync', 'full'), digest=digest)
+        for spreadsheet_id, sheet_name in uploads:
+            checkpoint_stage(upload_stage(spreadsheet_id, sheet_name), digest=digest)
+
+
+def reupload_from_store(job):
+    """Upload the latest stored run of a job's report (or of each part's) again, without scraping."""
+    from transforms import dataframe_rows
+    started = time.time()
+    result = {'name': job['name'], 'status': 'ok', 'duration': 0.0, 'error': None}
+    try:
+        for part in (job['parts'].values() if job.get('parts') else [job]):
+            df = load_merged_history(part['transform']) if part.get('incremental') else load_latest_run(part['transform'])
+            if df is None:
+                raise RuntimeError(f"No stored history for {part['transform']}")
+            google_rows_upload(dataframe_rows(df), part['uploads'], sync=part.get('sync', 'full'))
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+        logging.error(f"Re-upload of '{job['name']}' failed: {e}")
+    finally:
+        result['duration'] = round(time.time() - started, 1)
+    return result
+
+
+def _run_lane(job_queue, results, manifest):
+    """Pull jobs for one system until the queue is empty, reusing this thread's warm browser."""
+    try:
+        while True:
+            try:
+                job = job_queue.get_nowait()
+            except queue.Empty:
+                return
+            results.append(run_job(job, manifest))
+    finally:
+        close_browser_pool()
+
+
+def run_jobs(jobs, concurrency=None):
+    """
+    Run independent jobs concurrently, in separate browser contexts.
+    A rerun after a failure resumes from today's run manifest.
+    Args:
+        jobs: list of job dicts (see run_job)
+        concurrency: optional per-system overrides of SYSTEM_CONCURRENCY
+    Returns:
+        list of job results, in the order the jobs were given
+    """
+    limits = dict(SYSTEM_CONCURRENCY)
+    limits.update(concurrency or {})
+
+    queues = {}
+    for job in jobs:
+        queues.setdefault(job['system'], queue.Queue()).put(job)
+
+    manifest = start_run_manifest([job['name'] for job in jobs])
+    results = []
+    lanes = []
+    started = time.time()
+    for system, job_queue in queues.items():
+        # A lane may run every job of its system back to back
+        budget = sum(job.get('timeout', DEFAULT_JOB_TIMEOUT) for job in jobs if job['system'] == system) + LANE_GRACE
+        for _ in range(max(1, min(limits.get(system, 1), job_queue.qsize()))):
+            lane = threading.Thread(target=_run_lane, args=(job_queue, results, manifest), name=f"{system}-lane", daemon=True)
+            lane.start()
+            lanes.append((lane, started + budget))
+
+    for lane, give_up_at in lanes:
+        lane.join(max(0, give_up_at - time.time()))
+        if lane.is_alive():
+            logging.error(f"{lane.name} is still running past its jobs' timeouts; not waiting for it")
+
+    results = list(results)
+    finished = {result['name'] for result in results}
+    for job in jobs:
+        if job['name'] not in finished:
+            results.append({'name': job['name'], 'status': 'timeout', 'error': "Did not finish within its lane's time budget", 'duration': round(time.time() - started, 1)})
+
+    order = {job['name']: index for index, job in enumerate(jobs)}
+    results.sort(key=lambda result: order[result['name']])
+    finish_run_manifest(manifest, results)
+    log_job_summary(results)
+    return results
+
+
+async def run_job_async(job, semaphore, manifest=None):
+    """
+    Run a single job with its `async_activity` on the shared event loop.
+    As in run_job the activity gets `timeout` seconds; here an overrunning activity is cancelled outright.
+    """
+    started = time.time()
+    timeout = job.get('timeout', DEFAULT_JOB_TIMEOUT)
+    result = {'name': job['name'], 'status': 'ok', 'duration': 0.0, 'error': None}
+    try:
+        with span('job', job=job['name']), job_checkpoints(manifest, job['name']):
+            if job.get('async_capture'):
+                async with semaphore:
+                    logging.info(f"Job '{job['name']}' started")
+                    captured = await asyncio.wait_for(job['async_capture'](list(job['stat_uploads'])), timeout=timeout)
+                await asyncio.to_thread(_upload_captured, job, captured)
+                return result
+            if job.get('parts'):
+                pending = _pending_parts(job)
+                errors = {}
+                if pending:
+                    async with semaphore:
+                        logging.info(f"Job '{job['name']}' started")
+                        errors = await asyncio.wait_for(job['async_activity'](pending), timeout=timeout)
+                failed = _check_parts(job, pending, started, errors)
+                await asyncio.to_thread(_upload_parts, job, failed)
+                return result
+            if _download_checkpointed(job):
+                logging.info(f"Job '{job['name']}': download already checkpointed, skipping the activity")
+            else:
+                async with semaphore:
+                    logging.info(f"Job '{job['name']}' started")
+                    await asyncio.wait_for(job['async_activity'](), timeout=timeout)
+                _check_download(job, started)
+                _checkpoint_download(job)
+            await asyncio.to_thread(_upload_job, job)
+    except asyncio.TimeoutError:
+        result['status'] = 'timeout'
+        result['error'] = f"Exceeded {timeout}s timeout, skipping uploads"
+        logging.error(f"Job '{job['name']}': {result['error']}")
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+        logging.error(f"Job '{job['name']}' failed: {e}")
+    finally:
+        result['duration'] = round(time.time() - started, 1)
+    return result
+
+
+async def run_jobs_async(jobs, concurrency=None):
+    """
+    Run jobs concurrently on one event loop and one browser pool.
+    Args:
+        jobs: list of job dicts with an `async_activity` coroutine function
+        concurrency: optional per-system overrides of SYSTEM_CONCURRENCY
+    Returns:
+        list of job results, in the order the jobs were given
+    """
+    limits = dict(SYSTEM_CONCURRENCY)
+    limits.update(concurrency or {})
+    manifest = start_run_manifest([job['name'] for job in jobs])
+    semaphores = {system: asyncio.Semaphore(max(1, limits.get(system, 1))) for system in {job['system'] for job in jobs}}
+
+    try:
+        results = await asyncio.gather(*(run_job_async(job, semaphores[job['system']], manifest) for job in jobs))
+    finally:
+        import async_helper
+        await async_helper.close_browser_pool()
+
+    results = list(results)
+    finish_run_manifest(manifest, results)
+    log_job_summary(results)
+    return results
+
+
+def log_job_summary(results):
+    """Log one line per job result and an overall count."""
+    logging.info("Job summary:")
+    for result in results:
+        line = f"  {result['name']}: {result['status']} in {result['duration']}s"
+        if result['error']:
+            line += f" ({result['error']})"
+        logging.info(line)
+    failed = [result for result in results if result['status'] != 'ok']
+    logging.info(f"{len(results) - len(failed)}/{len(results)} jobs succeeded")
+
+
+# ===========================
+# Job Definitions
+# ===========================
+
+def _async_activity(name):
+    """An async activity resolved on first call, so sync runs never import the async Playwright stack."""
+    async def run(*args):
+        import async_activity
+        return await getattr(async_activity, name)(*args)
+    run.__name__ = name
+    return run
+
+
+def ecw_jobs():
+    """The ECW report jobs (main.py); with ECW_BATCH_SESSION, one job running them all in one login session."""
+    daily_pro_orders_sheet_id = os.getenv('DAILY_PRO_ORDERS_SPREADSHEET_ID')
+    dme_sheet_id = os.getenv('DME_SPREADSHEET_ID')
+    jobs = [
+        {
+            'name': 'Daily Pro Orders',
+            'system': 'ECW',
+            'activity': daily_pro_orders,
+            'report': 'daily_pro_orders',
+            'async_activity': _async_activity('daily_pro_orders'),
+            'download': os.path.join(download_dir, 'daily_pro_orders.csv'),
+            'uploads': [(daily_pro_orders_sheet_id, 'Main'), (dme_sheet_id, 'PS')],
+            'transform': 'daily_pro_orders',
+        },
+        {
+            'name': 'DME Orders',
+            'system': 'ECW',
+            'activity': dme_orders,
+            'report': 'dme_orders',
+            'async_activity': _async_activity('dme_orders'),
+            'download': os.path.join(download_dir, 'dme_orders.csv'),
+            'uploads': [(dme_sheet_id, 'DR')],
+            'transform': 'dme_orders',
+        },
+    ]
+    if incremental_enabled():
+        # Only the new days are downloaded; diff sync keeps the upload to the rows that changed
+        jobs[0].update({'incremental': ECW_REPORTS['daily_pro_orders']['incremental'], 'sync': 'diff'})
+    if not ecw_batch_enabled():
+        return jobs
+    return [{
+        'name': 'ECW Reports',
+        'system': 'ECW',
+        'activity': ecw_report_session,
+        'async_activity': _async_activity('ecw_report_session'),
+        'parts': {job['report']: job for job in jobs},
+    }]
+
+
+def comtec_jobs():
+    """The Comtec call reporting jobs (main_call.py)."""
+    call_reporting = os.getenv('CALL_REPORT_SHEET_ID')
+    job = {
+        'name': 'Daily Abonded Calls Reporting',
+        'system': 'COMTEC',
+        'activity': daily_call_comtech_report,
+        'async_activity': _async_activity('daily_call_comtech_report'),
+        'download': os.path.join(download_dir, 'daily_abandoned_calls.csv'),
+        'uploads': [(call_reporting, 'Data')],
+        'transform': 'daily_abandoned_calls',
+        'sync': 'diff',
+        'window': daily_call_date_range,
+    }
+    if capture_statistics_enabled():
+        # Every COMTEC_STAT_TYPES statistic in one session, read from the page instead of downloaded
+        job.update({
+            'capture': comtec_call_statistics,
+            'async_capture': _async_activity('comtec_call_statistics'),
+            'stat_uploads': {stat_type: [(call_reporting, tab)] for stat_type, tab in comtec_stat_types().items()},
+            'stat_transforms': {'abandoned': 'daily_abandoned_calls'},
+        })
+    return [job]
+
+
+def job_catalog():
+    """Every known job by name, for runners that receive job names (e.g. the worker queue)."""
+    return {job['name']: job for job in ecw_jobs() + comtec_jobs()}
@@ -1,22 +1,24 @@
 import os
-from helper import *
-from activity import *
+import asyncio
+import logging
+from helper import init, close_browser_pool
+from jobs import run_jobs, run_jobs_async, reupload_from_store, log_job_summary, comtec_jobs
 
 def main():
+    init()
     try:
-        # Production Google Sheet IDs
-        call_reporting = os.getenv('CALL_REPORT_SHEET_ID')
-        
-        #Daily Call Comtech Report
-        logging.info('Daily Abonded Calls Reporting')
-        browser, playwright, page = launch_browser(headless=True)
-        daily_call_comtech_report(page,browser,playwright)
-        daily_abonded_download = os.path.join(download_dir, 'daily_abandoned_calls.csv')
-        google_data_upload(daily_abonded_download,'Data',call_reporting)
-        logging.info('Daily Abonded Call Reporting Complete')
+        jobs = comtec_jobs()
+        if os.getenv('REUPLOAD_FROM_STORE', 'false').lower() == 'true':
+            log_job_summary([reupload_from_store(job) for job in jobs])
+        elif os.getenv('ASYNC_JOBS', 'false').lower() == 'true':
+            asyncio.run(run_jobs_async(jobs))
+        else:
+            run_jobs(jobs)
         
     except Exception as e:
         logging.error(f"An error occurred in the main function: {e}")
+    finally:
+        close_browser_pool()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,172 @@
+import os
+import re
+import logging
+from datetime import datetime
+import helper
+
+
+# ===========================
+# Report Store
+# ===========================
+
+# Hive-style layout: store/report=<name>/run_date=<YYYY-MM-DD>/part-<HHMMSS>.parquet
+
+def store_dir():
+    """Root of the report store, under helper.base_dir."""
+    return os.path.join(helper.base_dir, 'store')
+
+
+def normalize_column_name(name):
+    """Strip the BOM and stray whitespace that ECW's UTF-16 exports leave in headers."""
+    name = str(name).replace('\ufeff', '')
+    return re.sub(r'\s+', ' ', name).strip() or 'Column'
+
+
+def normalize_schema(df):
+    """Normalize headers (clean, unique) and make untyped columns plain strings."""
+    names = []
+    seen = {}
+    for name in map(normalize_column_name, df.columns):
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name} ({seen[name]})")
+
+    df = df.copy()
+    df.columns = names
+    for name in df.columns:
+        if df[name].dtype == object:
+            df[name] = df[name].astype(str)
+    return df
+
+
+def report_partition_dir(report, run_date):
+    """Directory holding every run of a report on one day."""
+    return os.path.join(store_dir(), f"report={report}", f"run_date={run_date}")
+
+
+def store_report(df, report, run_at=None):
+    """
+    Append one downloaded report to the local Parquet history.
+    Args:
+        df: Report DataFrame (raw or typed)
+        report: Report name, e.g. 'daily_pro_orders'
+        run_at: Run timestamp (default: now)
+    Returns:
+        Path of the written Parquet file
+    """
+    import pandas as pd
+    run_at = run_at or datetime.now()
+    partition = report_partition_dir(report, run_at.strftime('%Y-%m-%d'))
+    os.makedirs(partition, exist_ok=True)
+
+    df = normalize_schema(df)
+    df['run_at'] = pd.Timestamp(run_at)
+    path = os.path.join(partition, f"part-{run_at.strftime('%H%M%S')}.parquet")
+    df.to_parquet(path, index=False)
+    logging.info(f"Stored {len(df)} rows of {report} in {path}")
+    return path
+
+
+def load_report_history(report, start_date=None, end_date=None, columns=None):
+    """
+    Load stored runs of a report, optionally limited to a run_date range (YYYY-MM-DD, inclusive).
+    Only the matching partitions and columns are read.
+    """
+    import pandas as pd
+    report_dir = os.path.join(store_dir(), f"report={report}")
+    if not os.path.isdir(report_dir):
+        return pd.DataFrame()
+
+    frames = []
+    for partition in sorted(os.listdir(report_dir)):
+        run_date = partition.split('=', 1)[-1]
+        if (start_date and run_date < start_date) or (end_date and run_date > end_date):
+            continue
+        for part in sorted(os.listdir(os.path.join(report_dir, partition))):
+            frame = pd.read_parquet(os.path.join(report_dir, partition, part), columns=columns)
+            frames.append(frame.assign(run_date=run_date))
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def latest_run_path(report):
+    """Path of the most recent stored run of a report, or None when there is none."""
+    report_dir = os.path.join(store_dir(), f"report={report}")
+    if not os.path.isdir(report_dir):
+        return None
+
+    partitions = sorted(os.listdir(report_dir))
+    if not partitions:
+        return None
+    latest_dir = os.path.join(report_dir, partitions[-1])
+    parts = sorted(os.listdir(latest_dir))
+    if not parts:
+        return None
+    return os.path.join(latest_dir, parts[-1])
+
+
+def load_latest_run(report):
+    """Load the most recent stored run of a report, without the bookkeeping columns."""
+    import pandas as pd
+    path = latest_run_path(report)
+    if path is None:
+        return None
+    return pd.read_parquet(path).drop(columns=['run_at'])
+
+
+def merged_history_path(report):
+    """Path of an incremental report's merged table: the whole history, one copy, rewritten on each merge."""
+    return os.path.join(store_dir(), 'merged', f"{report}.parquet")
+
+
+def load_merged_history(report):
+    """Load an incremental report's merged table, or None when it has none yet."""
+    import pandas as pd
+    if not os.path.exists(merged_history_path(report)):
+        return None
+    return pd.read_parquet(merged_history_path(report))
+
+
+def merge_report_history(df, report, key, date_column, window):
+    """
+    Merge a freshly downloaded window of a report into its merged table and save the result.
+    History rows dated inside the window are replaced by the new slice, so rows that left the
+    report (deleted, or no longer matching its filters) disappear; rows outside the window whose
+    `key` reappears in the slice are replaced too. Rows outside the window keep their order.
+    Args:
+        df: Typed report DataFrame holding only the requested window
+        report: Report name, e.g. 'daily_pro_orders'
+        key: Columns identifying an order
+        date_column: Column the report's date prompt filters on
+        window: (start, end) dates that were requested, inclusive
+    Returns:
+        The merged DataFrame
+    Raises:
+        ValueError when the key or date columns are missing, rather than guessing at a match
+    """
+    import pandas as pd
+    df = normalize_schema(df)
+    missing = [name for name in [*key, date_column] if name not in df.columns]
+    if missing:
+        raise ValueError(f"{report} has no {', '.join(missing)} column(s); fix its incremental key/date_column "
+                         f"or turn INCREMENTAL_EXTRACT off")
+
+    history = load_merged_history(report)
+    if history is not None and not history.empty:
+        start, end = (pd.Timestamp(day) for day in window)
+        dates = pd.to_datetime(history[date_column], errors='coerce').dt.normalize()
+        in_window = dates.between(start, end)
+        history_keys = pd.util.hash_pandas_object(history[key].astype(str), index=False)
+        slice_keys = pd.util.hash_pandas_object(df[key].astype(str), index=False)
+        kept = history[~in_window & ~history_keys.isin(slice_keys)]
+        merged = pd.concat([kept, df], ignore_index=True)
+        logging.info(f"Merged {len(df)} rows of {report} for {window[0]} to {window[1]} into "
+                     f"{len(history)} stored rows ({len(history) - len(kept)} replaced): {len(merged)} rows")
+    else:
+        merged = df.reset_index(drop=True)
+
+    os.makedirs(os.path.dirname(merged_history_path(report)), exist_ok=True)
+    merged.to_parquet(f"{merged_history_path(report)}.tmp", index=False)
+    os.replace(f"{merged_history_path(report)}.tmp", merged_history_path(report))
+    return merged
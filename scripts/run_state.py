@@ -0,0 +1,232 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import helper
+from helper import RUN_ID, chicago_today
+
+# What one run leaves for the next: stage checkpoints, report watermarks and upload digests.
+# Files live under helper.config_dir, read through the module so a scratch directory set after import applies.
+# Queue workers run jobs in separate processes, so each file is replaced atomically under a per-process
+# temp name (helper.write_json_atomic) and read-modify-write updates also hold a lock on the file.
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on `<path>.lock`, shared by every process using the same config directory."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# ===========================
+# Run Manifest
+# ===========================
+
+# One manifest per run date and job set (each entry point runs its own jobs) records which
+# stages of each job finished, so a rerun after a failure resumes where it stopped. A fully
+# successful run is closed and the next run of the day starts a fresh manifest.
+_manifest_lock = threading.Lock()
+_current_job = contextvars.ContextVar('current_job', default=None)  # (manifest, job name)
+
+def manifest_dir():
+    """Directory holding the run manifests."""
+    return os.path.join(helper.config_dir, 'manifests')
+
+def resume_enabled():
+    """Whether a rerun skips stages checkpointed by an unfinished earlier run of the day."""
+    return os.getenv('RESUME_RUNS', 'true').lower() in ('1', 'true', 'yes')
+
+def file_digest(path, chunk_size=1 << 20):
+    """blake2b digest of a file's contents."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as report_file:
+        for chunk in iter(lambda: report_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def job_set_key(job_names):
+    """Short stable key of a set of job names, so entry points with different jobs never share a manifest."""
+    return hashlib.blake2b('\n'.join(sorted(job_names)).encode('utf-8'), digest_size=4).hexdigest()
+
+def manifest_path(run_date, job_set):
+    """Path of the run manifest for a YYYY-MM-DD run date and a job_set_key."""
+    return os.path.join(manifest_dir(), f'{run_date}_{job_set}.json')
+
+def save_manifest(manifest):
+    """Write the manifest atomically, so a crash never leaves it half-written."""
+    os.makedirs(manifest_dir(), exist_ok=True)
+    helper.write_json_atomic(manifest_path(manifest['run_date'], manifest['job_set']), manifest, indent=2)
+
+def start_run_manifest(job_names, run_date=None):
+    """Resume today's unfinished manifest for these jobs, or start a new one."""
+    run_date = run_date or datetime.now().strftime('%Y-%m-%d')
+    job_set = job_set_key(job_names)
+    path = manifest_path(run_date, job_set)
+    manifest = None
+    if resume_enabled() and os.path.exists(path):
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('complete'):
+            manifest = None
+        else:
+            logging.info(f"Resuming unfinished run {manifest['run_id']} from {path}")
+
+    if manifest is None:
+        manifest = {'run_date': run_date, 'job_set': job_set, 'run_id': RUN_ID, 'complete': False, 'jobs': {}}
+    save_manifest(manifest)
+    return manifest
+
+def finish_run_manifest(manifest, results):
+    """Close the manifest when every job succeeded; otherwise leave it for the next run to resume."""
+    manifest['complete'] = all(result['status'] == 'ok' for result in results)
+    with _manifest_lock:
+        save_manifest(manifest)
+
+@contextmanager
+def job_checkpoints(manifest, job_name):
+    """Make checkpoint_stage/checkpointed_stage record against `job_name` in `manifest`."""
+    token = _current_job.set((manifest, job_name) if manifest is not None else None)
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+def checkpoint_stage(stage, **details):
+    """Record that a stage of the current job finished. No-op outside job_checkpoints."""
+    current = _current_job.get()
+    if current is None:
+        return
+    manifest, job_name = current
+    with _manifest_lock:
+        stages = manifest['jobs'].setdefault(job_name, {})
+        stages[stage] = {'at': datetime.now().isoformat(timespec='seconds'), **details}
+        save_manifest(manifest)
+
+def checkpointed_stage(stage):
+    """The checkpoint of a stage of the current job, or None when it has not finished."""
+    current = _current_job.get()
+    if current is None:
+        return None
+    manifest, job_name = current
+    with _manifest_lock:
+        return manifest['jobs'].get(job_name, {}).get(stage)
+
+def upload_stage(spreadsheet_id, sheet_name):
+    """Stage name of one upload target."""
+    return f"upload:{spreadsheet_id}/{sheet_name}"
+
+
+# ===========================
+# Watermarks
+# ===========================
+
+# Per incremental report: the last window that was stored and uploaded end to end (start, end,
+# loaded_at) and the window of the run in progress (pending). A pending window only becomes the
+# watermark through commit_window, so a failed run asks for the same days again.
+_watermark_lock = threading.Lock()
+
+def incremental_enabled():
+    """Whether reports with an incremental definition request only their new days."""
+    return os.getenv('INCREMENTAL_EXTRACT', 'false').lower() in ('1', 'true', 'yes')
+
+def watermark_path():
+    """Path of the per-report watermark file."""
+    return os.path.join(helper.config_dir, 'watermarks.json')
+
+def load_watermarks():
+    if not os.path.exists(watermark_path()):
+        return {}
+    with open(watermark_path()) as watermark_file:
+        return json.load(watermark_file)
+
+def _save_watermarks(watermarks):
+    helper.write_json_atomic(watermark_path(), watermarks, indent=2)
+
+def incremental_window(report, first_start, overlap_days=0, today=None):
+    """
+    The window to request for an incremental report, recorded as its pending window.
+    Starts `overlap_days` before the end of the last loaded window, or at `first_start` when there
+    is no watermark or no stored history to merge into (the history is rebuilt with a full pull).
+    Returns:
+        (start, end) dates, end being today in Chicago
+    """
+    from report_store import merged_history_path
+    today = today or chicago_today()
+    with _watermark_lock, file_lock(watermark_path()):
+        watermarks = load_watermarks()
+        loaded = watermarks.get(report, {}).get('end')
+        if loaded and os.path.exists(merged_history_path(report)):
+            start = max(first_start, min(date.fromisoformat(loaded), today) - timedelta(days=overlap_days))
+            logging.info(f"{report}: loaded through {loaded}, requesting {start} to {today}")
+        else:
+            start = first_start
+            logging.info(f"{report}: no watermark or stored history, requesting the full range from {start}")
+        watermarks.setdefault(report, {})['pending'] = {'start': start.isoformat(), 'end': today.isoformat()}
+        _save_watermarks(watermarks)
+    return start, today
+
+def pending_window(report):
+    """The (start, end) dates the run in progress requested for a report, or None."""
+    with _watermark_lock, file_lock(watermark_path()):
+        pending = load_watermarks().get(report, {}).get('pending')
+    return (date.fromisoformat(pending['start']), date.fromisoformat(pending['end'])) if pending else None
+
+def commit_window(report):
+    """Make a report's pending window its watermark, once its rows are stored and uploaded."""
+    with _watermark_lock, file_lock(watermark_path()):
+        watermarks = load_watermarks()
+        pending = watermarks.get(report, {}).pop('pending', None)
+        if pending is None:
+            return
+        watermarks[report].update(pending, loaded_at=datetime.now().isoformat(timespec='seconds'))
+        _save_watermarks(watermarks)
+    logging.info(f"{report}: watermark moved to {pending['end']}")
+
+
+# ===========================
+# Upload Cache
+# ===========================
+
+# Last content digest (see file_digest) successfully uploaded to each tab. A report that is
+# byte-identical to what a tab already holds is not uploaded again.
+_upload_cache_lock = threading.Lock()
+
+def skip_unchanged_uploads():
+    """Whether uploads of content a tab already holds are skipped."""
+    return os.getenv('SKIP_UNCHANGED_UPLOADS', 'true').lower() in ('1', 'true', 'yes')
+
+def upload_cache_path():
+    """Path of the per-tab upload digest cache."""
+    return os.path.join(helper.config_dir, 'upload_cache.json')
+
+def _load_upload_cache():
+    if not os.path.exists(upload_cache_path()):
+        return {}
+    with open(upload_cache_path()) as cache_file:
+        return json.load(cache_file)
+
+def uploaded_digest(spreadsheet_id, sheet_name):
+    """Digest of the content last uploaded to a tab, or None."""
+    with _upload_cache_lock, file_lock(upload_cache_path()):
+        return _load_upload_cache().get(f'{spreadsheet_id}/{sheet_name}')
+
+def record_upload(targets, digest):
+    """Remember that `targets` now hold `digest`; a None digest forgets them (unknown or partial content)."""
+    with _upload_cache_lock, file_lock(upload_cache_path()):
+        cache = _load_upload_cache()
+        for spreadsheet_id, sheet_name in targets:
+            if digest is None:
+                cache.pop(f'{spreadsheet_id}/{sheet_name}', None)
+            else:
+                cache[f'{spreadsheet_id}/{sheet_name}'] = digest
+        helper.write_json_atomic(upload_cache_path(), cache, indent=2)
@@ -0,0 +1,417 @@
+import os
+import re
+import time
+import json
+import hashlib
+import itertools
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import helper
+
+# The Google client libraries are imported where they are used, so importing this module stays cheap.
+
+
+# ===========================
+# Google Sheets Operations
+# ===========================
+
+def write_sheet_data(spreadsheet_id, range_name, values, credentials):
+    """Write data to a Google Sheets document."""
+    from googleapiclient.discovery import build
+    service = build('sheets', 'v4', credentials=credentials)
+    
+    # Clear the existing data in the specified range
+    service.spreadsheets().values().clear(
+        spreadsheetId=spreadsheet_id,
+        range=range_name
+    ).execute()
+    
+    # Prepare the new data to be written
+    body = {'values': values}
+    
+    # Write the new data to the specified range
+    service.spreadsheets().values().update(
+        spreadsheetId=spreadsheet_id,
+        range=range_name,
+        valueInputOption='USER_ENTERED',
+        body=body
+    ).execute()
+
+SHEETS_CHUNK_ROWS = int(os.getenv('SHEETS_CHUNK_ROWS', '5000'))
+SHEETS_RETRIES = int(os.getenv('SHEETS_RETRIES', '5'))  # retried on 429 and 5xx with backoff
+
+def column_letter(index):
+    """Convert a 1-based column index to its A1 letter (1 -> A, 27 -> AA)."""
+    letters = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def a1_range(sheet_name, start_row, end_row, width):
+    """Build an explicit A1 range such as 'Main'!A1:F5000."""
+    quoted = sheet_name.replace("'", "''")
+    return f"'{quoted}'!A{start_row}:{column_letter(max(width, 1))}{end_row}"
+
+def iter_row_chunks(rows, size):
+    """Yield lists of at most `size` rows from any row iterator."""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def clear_request(sheet_id):
+    """batchUpdate request that clears every value in a tab."""
+    return {
+        'updateCells': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': 0,
+                'startColumnIndex': 0
+            },
+            'fields': 'userEnteredValue'
+        }
+    }
+
+def clear_sheet(service, spreadsheet_id, sheet_id):
+    """Clear every value in a tab using batchUpdate."""
+    service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={'requests': [clear_request(sheet_id)]}
+    ).execute(num_retries=SHEETS_RETRIES)
+
+def grow_requests(sheet, last_row, width, chunk_size):
+    """
+    batchUpdate requests that grow a tab to fit `last_row` x `width`.
+    values().update does not grow the grid, so this must run before writing.
+    The cached gridProperties are updated in step with the sheet.
+    """
+    grid = sheet.setdefault('gridProperties', {})
+    requests = []
+    if last_row > grid.get('rowCount', 0):
+        length = max(last_row - grid.get('rowCount', 0), chunk_size)
+        requests.append({'appendDimension': {'sheetId': sheet['sheetId'], 'dimension': 'ROWS', 'length': length}})
+        grid['rowCount'] = grid.get('rowCount', 0) + length
+    if width > grid.get('columnCount', 0):
+        requests.append({'appendDimension': {'sheetId': sheet['sheetId'], 'dimension': 'COLUMNS', 'length': width - grid.get('columnCount', 0)}})
+        grid['columnCount'] = width
+    return requests
+
+def _write_chunk(spreadsheet_id, sheets, chunk, first_row, chunk_size, requests):
+    """Write one chunk to every tab of a spreadsheet: one batchUpdate (clears, grid growth) and one values.batchUpdate."""
+    service = get_sheets_service()
+    last_row = first_row + len(chunk) - 1
+    width = max(len(row) for row in chunk)
+
+    requests = list(requests)
+    for sheet in sheets:
+        requests.extend(grow_requests(sheet, last_row, width, chunk_size))
+    if requests:
+        service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={'requests': requests}
+        ).execute(num_retries=SHEETS_RETRIES)
+
+    service.spreadsheets().values().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={
+            'valueInputOption': 'RAW',
+            'data': [{'range': a1_range(sheet['title'], first_row, last_row, width), 'values': chunk} for sheet in sheets]
+        }
+    ).execute(num_retries=SHEETS_RETRIES)
+    logging.info(f"Wrote rows {first_row}-{last_row} to {', '.join(sheet['title'] for sheet in sheets)}")
+
+def write_rows_to_targets(rows, targets, chunk_size=None):
+    """
+    Replace the contents of every target tab with `rows`, reading the rows only once.
+    Tabs in the same spreadsheet share each request; different spreadsheets are written in parallel.
+    Args:
+        rows: Any iterator of rows; it is consumed lazily, one chunk at a time
+        targets: List of (spreadsheet_id, sheet_name) tuples
+        chunk_size: Rows per request (default SHEETS_CHUNK_ROWS)
+    Returns:
+        Number of rows written to each target
+    """
+    chunk_size = chunk_size or SHEETS_CHUNK_ROWS
+    sheet_names = {}
+    for spreadsheet_id, sheet_name in targets:
+        sheet_names.setdefault(spreadsheet_id, []).append(sheet_name)
+
+    service = get_sheets_service()
+    sheets = {
+        spreadsheet_id: [get_sheet_properties(service, spreadsheet_id, name) for name in names]
+        for spreadsheet_id, names in sheet_names.items()
+    }
+    # The clears ride along with the first chunk's batchUpdate
+    pending_clears = {
+        spreadsheet_id: [clear_request(sheet['sheetId']) for sheet in tabs]
+        for spreadsheet_id, tabs in sheets.items()
+    }
+
+    written = 0
+    hashes = []
+    width = 0
+    try:
+        with ThreadPoolExecutor(max_workers=len(sheets)) as executor:
+            for chunk in iter_row_chunks(rows, chunk_size):
+                futures = [
+                    executor.submit(_write_chunk, spreadsheet_id, tabs, chunk, written + 1, chunk_size, pending_clears.pop(spreadsheet_id, []))
+                    for spreadsheet_id, tabs in sheets.items()
+                ]
+                # Hash while the writes are in flight, for later diff syncs
+                hashes.extend(row_hash(row) for row in chunk)
+                width = max(width, max(len(row) for row in chunk))
+                for future in futures:
+                    future.result()
+                written += len(chunk)
+
+        # Empty file: the tabs still need clearing
+        for spreadsheet_id, requests in pending_clears.items():
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'requests': requests}
+            ).execute(num_retries=SHEETS_RETRIES)
+    except Exception:
+        for target in targets:
+            clear_sheet_snapshot(*target)
+        raise
+
+    for spreadsheet_id, sheet_name in targets:
+        save_sheet_snapshot(spreadsheet_id, sheet_name, hashes, width)
+    return written
+
+# ===========================
+# Differential Sheet Sync
+# ===========================
+
+def row_hash(row):
+    """Short, stable hash of a CSV row."""
+    return hashlib.blake2b('\x1f'.join(map(str, row)).encode('utf-8'), digest_size=8).hexdigest()
+
+def snapshot_dir():
+    """Directory holding the per-tab snapshots."""
+    return os.path.join(helper.config_dir, 'sheet_snapshots')
+
+def snapshot_path(spreadsheet_id, sheet_name):
+    """Path of the local snapshot of what was last written to a tab."""
+    safe_name = re.sub(r'[^A-Za-z0-9_-]', '_', sheet_name)
+    return os.path.join(snapshot_dir(), f'{spreadsheet_id}_{safe_name}.json')
+
+def load_sheet_snapshot(spreadsheet_id, sheet_name):
+    """
+    Return {'hashes': [...], 'width': n} for a tab, or None when the tab has no snapshot.
+    An unreadable snapshot is cleared and treated as missing, so the tab is rewritten in full.
+    """
+    path = snapshot_path(spreadsheet_id, sheet_name)
+    try:
+        with open(path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if not isinstance(snapshot, dict) or not isinstance(snapshot.get('hashes'), list) or 'width' not in snapshot:
+            raise ValueError("not a snapshot")
+        return snapshot
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Snapshot of '{sheet_name}' is unreadable, rewriting the tab in full: {str(e)}")
+        clear_sheet_snapshot(spreadsheet_id, sheet_name)
+        return None
+
+def save_sheet_snapshot(spreadsheet_id, sheet_name, hashes, width):
+    """Record the row hashes and width just written to a tab."""
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    helper.write_json_atomic(snapshot_path(spreadsheet_id, sheet_name), {'hashes': hashes, 'width': width})
+
+def clear_sheet_snapshot(spreadsheet_id, sheet_name):
+    """Forget a tab's snapshot so the next sync rewrites it in full."""
+    try:
+        os.remove(snapshot_path(spreadsheet_id, sheet_name))
+    except FileNotFoundError:
+        pass
+
+def contiguous_runs(numbered_rows):
+    """Split [(row_number, row), ...] into runs of consecutive row numbers."""
+    runs = []
+    for row_number, row in numbered_rows:
+        if runs and runs[-1][-1][0] == row_number - 1:
+            runs[-1].append((row_number, row))
+        else:
+            runs.append([(row_number, row)])
+    return runs
+
+def _write_changed_rows(service, spreadsheet_id, sheet, numbered_rows, min_width, chunk_size):
+    """Write changed rows as one values.batchUpdate, padding them so stale trailing cells are cleared."""
+    if not numbered_rows:
+        return
+    data = []
+    requests = []
+    for run in contiguous_runs(numbered_rows):
+        width = max(min_width, max(len(row) for _, row in run))
+        requests.extend(grow_requests(sheet, run[-1][0], width, chunk_size))
+        data.append({
+            'range': a1_range(sheet['title'], run[0][0], run[-1][0], width),
+            'values': [row + [''] * (width - len(row)) for _, row in run]
+        })
+    if requests:
+        service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={'requests': requests}
+        ).execute(num_retries=SHEETS_RETRIES)
+    service.spreadsheets().values().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={'valueInputOption': 'RAW', 'data': data}
+    ).execute(num_retries=SHEETS_RETRIES)
+    logging.info(f"Wrote {len(numbered_rows)} changed rows in {len(data)} ranges to '{sheet['title']}'")
+
+def sync_rows_to_targets(rows, targets, chunk_size=None):
+    """
+    Bring every target tab in line with `rows`, sending only changed rows, appended rows and trailing-row clears.
+    Tabs without a snapshot are cleared and written in full.
+    Args:
+        rows: Any iterator of rows; it is consumed lazily
+        targets: List of (spreadsheet_id, sheet_name) tuples
+        chunk_size: Changed rows buffered per target before they are sent (default SHEETS_CHUNK_ROWS)
+    Returns:
+        Number of rows in the new data
+    """
+    chunk_size = chunk_size or SHEETS_CHUNK_ROWS
+    service = get_sheets_service()
+    sheets = {target: get_sheet_properties(service, *target) for target in targets}
+    snapshots = {target: load_sheet_snapshot(*target) for target in targets}
+
+    try:
+        for (spreadsheet_id, sheet_name), snapshot in snapshots.items():
+            if snapshot is None:
+                logging.info(f"No snapshot for '{sheet_name}', rewriting it in full")
+                clear_sheet(service, spreadsheet_id, sheets[(spreadsheet_id, sheet_name)]['sheetId'])
+
+        hashes = []
+        width = 0
+        pending = {target: [] for target in targets}
+        for row_number, row in enumerate(rows, start=1):
+            current = row_hash(row)
+            hashes.append(current)
+            width = max(width, len(row))
+            for target, snapshot in snapshots.items():
+                old_hashes = snapshot['hashes'] if snapshot else []
+                if row_number > len(old_hashes) or old_hashes[row_number - 1] != current:
+                    pending[target].append((row_number, row))
+                    if len(pending[target]) >= chunk_size:
+                        old_width = snapshot['width'] if snapshot else 0
+                        _write_changed_rows(service, target[0], sheets[target], pending[target], old_width, chunk_size)
+                        pending[target] = []
+
+        for target, snapshot in snapshots.items():
+            old_width = snapshot['width'] if snapshot else 0
+            _write_changed_rows(service, target[0], sheets[target], pending[target], old_width, chunk_size)
+            if snapshot and len(snapshot['hashes']) > len(hashes):
+                service.spreadsheets().values().clear(
+                    spreadsheetId=target[0],
+                    range=a1_range(target[1], len(hashes) + 1, len(snapshot['hashes']), max(old_width, 1))
+                ).execute(num_retries=SHEETS_RETRIES)
+                logging.info(f"Cleared {len(snapshot['hashes']) - len(hashes)} trailing rows from '{target[1]}'")
+            save_sheet_snapshot(target[0], target[1], hashes, width)
+    except Exception:
+        # The tabs are now in an unknown state; the next sync must rewrite them
+        for target in targets:
+            clear_sheet_snapshot(*target)
+        raise
+
+    return len(hashes)
+
+# ===========================
+# Google Credentials
+# ===========================
+
+# Credentials are reused in memory; the token file is only read once per process.
+_credentials = None
+_credentials_lock = threading.Lock()
+
+def get_user_credentials():
+    """Get user credentials for Google Sheets API."""
+    global _credentials
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    token_path = os.path.join(helper.config_dir, 'token.json')
+
+    with _credentials_lock:
+        creds = _credentials
+        if creds is None and os.path.exists(token_path):
+            creds = Credentials.from_authorized_user_file(token_path)
+
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    os.path.join(helper.config_dir, 'credentials.json'), SCOPES)
+                creds = flow.run_local_server(port=0)
+
+            with open(token_path, 'w') as token:
+                token.write(creds.to_json())
+
+        _credentials = creds
+        return creds
+
+# ===========================
+# Sheets Client Cache
+# ===========================
+
+SHEET_CACHE_TTL = int(os.getenv('SHEET_CACHE_TTL', '300'))  # seconds
+
+# httplib2 connections are not thread-safe, so each thread keeps its own client.
+_sheets_local = threading.local()
+_sheets_discovery_doc = None
+_sheet_cache = {}  # spreadsheet_id -> (fetched_at, {title: properties})
+_sheet_cache_lock = threading.Lock()
+
+def _build_sheets_service(credentials):
+    """Build a Sheets client from the discovery document, parsed once per process."""
+    global _sheets_discovery_doc
+    from googleapiclient.discovery import build, build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    if _sheets_discovery_doc is None:
+        _sheets_discovery_doc = get_static_doc('sheets', 'v4')
+    # SHEETS_API_ENDPOINT points the client at another host, e.g. the offline benchmark's stand-in
+    client_options = {'api_endpoint': os.getenv('SHEETS_API_ENDPOINT')} if os.getenv('SHEETS_API_ENDPOINT') else None
+    if _sheets_discovery_doc is None:
+        return build('sheets', 'v4', credentials=credentials, client_options=client_options)
+    return build_from_document(_sheets_discovery_doc, credentials=credentials, client_options=client_options)
+
+def get_sheets_service():
+    """Return this thread's cached Sheets client."""
+    credentials = get_user_credentials()
+    if getattr(_sheets_local, 'credentials', None) is not credentials:
+        _sheets_local.service = _build_sheets_service(credentials)
+        _sheets_local.credentials = credentials
+    return _sheets_local.service
+
+def get_sheet_properties(service, spreadsheet_id, sheet_name):
+    """Return the properties (sheetId, title, gridProperties) of a tab by name, cached for SHEET_CACHE_TTL."""
+    with _sheet_cache_lock:
+        cached = _sheet_cache.get(spreadsheet_id)
+    if cached is None or time.time() - cached[0] > SHEET_CACHE_TTL:
+        spreadsheet = service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties(sheetId,title,gridProperties)'
+        ).execute(num_retries=SHEETS_RETRIES)
+        sheets = {sheet["properties"]["title"]: sheet["properties"] for sheet in spreadsheet.get('sheets', [])}
+        cached = (time.time(), sheets)
+        with _sheet_cache_lock:
+            _sheet_cache[spreadsheet_id] = cached
+
+    if sheet_name not in cached[1]:
+        raise ValueError(f"Sheet with name '{sheet_name}' not found.")
+    return cached[1][sheet_name]
+
+def invalidate_sheet_cache(spreadsheet_id=None):
+    """Drop cached tab metadata for one spreadsheet, or for all of them."""
+    with _sheet_cache_lock:
+        if spreadsheet_id is None:
+            _sheet_cache.clear()
+        else:
+            _sheet_cache.pop(spreadsheet_id, None)
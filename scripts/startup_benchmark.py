@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+
+# ===========================
+# Startup Benchmark
+# ===========================
+#
+# Measures what each entry point costs to import, in fresh interpreters, before any browser
+# starts. Cron-triggered runs should stay well under a second.
+#
+#   python startup_benchmark.py --runs 5 --json startup.json
+
+ENTRY_POINTS = ['main', 'main_call', 'workers', 'benchmark']
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_importtime(stderr):
+    """
+    Import time per package, in seconds, from `python -X importtime` output.
+    A package is charged the cumulative time of its outermost imports, i.e. those made by
+    another package, so pandas' own submodules are not counted twice.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip().split('.')[0], int(cumulative) / 1e6))
+
+    # importtime prints children before their parent; walking backwards visits parents first
+    totals = {}
+    packages_by_depth = []
+    for depth, package, seconds in reversed(entries):
+        del packages_by_depth[depth:]
+        if not packages_by_depth or packages_by_depth[-1] != package:
+            totals[package] = totals.get(package, 0) + seconds
+        packages_by_depth.append(package)
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def measure_import(module, runs=5, top=8):
+    """
+    Import an entry point in `runs` fresh interpreters.
+    Returns:
+        dict with the median and fastest wall times and the `top` most expensive packages
+    """
+    times = []
+    packages = {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=scripts_dir, capture_output=True, text=True
+        )
+        times.append(time.perf_counter() - started)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+        packages = parse_importtime(completed.stderr)
+        packages.pop(module, None)
+
+    return {
+        'module': module,
+        'median_s': round(statistics.median(times), 3),
+        'min_s': round(min(times), 3),
+        'heaviest': {name: round(seconds, 3) for name, seconds in list(packages.items())[:top]},
+    }
+
+
+def format_results(results):
+    """Render startup results as a plain-text table."""
+    lines = [f"{'entry point':<12} {'median_s':>8} {'min_s':>6}  heaviest imports (s)"]
+    for result in results:
+        heaviest = ', '.join(f"{name} {seconds:.3f}" for name, seconds in result['heaviest'].items())
+        lines.append(f"{result['module']:<12} {result['median_s']:>8.3f} {result['min_s']:>6.3f}  {heaviest}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import cost of each entry point.')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = [measure_import(module, args.runs) for module in args.modules]
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+if __name__ == "__main__":
+    main()
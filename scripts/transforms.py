@@ -0,0 +1,150 @@
+import re
+import logging
+import pandas as pd
+from ingest import read_table
+
+
+# ===========================
+# Report Specs
+# ===========================
+
+# Column rules are (header regex, dtype) pairs, applied in order; the first match wins.
+# Supported dtypes: 'datetime', 'float', 'int', 'string'.
+ECW_COLUMN_RULES = [
+    (r'(?i)\b(date|dob|dos)\b', 'datetime'),
+    (r'(?i)\b(amount|balance|charges?|payments?|copay|fee)\b', 'float'),
+    (r'(?i)\b(age|count|units)\b', 'int'),
+]
+
+REPORT_SPECS = {
+    'payment_summary': {
+        'layout': 'summary',
+        'cards': [
+            ('Visa', 'Visa'),
+            ('MasterCard', 'MasterCard'),
+            ('American Express', 'American'),
+            ('Discover', 'Discover'),
+            ('Apple Pay', 'Apple'),
+            ('ACH (eCheck)', 'ACH'),
+        ],
+        'sections': {
+            'Sales Summary': (0, 'Total sales'),
+            'Declined Summary': (4, 'Total declined'),
+            'Credit Summary': (8, 'Total credit'),
+            'Net Total': (12, 'Total net'),
+        },
+        'rows': (3, 9),
+        'totals_row': 9,
+    },
+    'daily_pro_orders': {
+        'layout': 'table',
+        'columns': ECW_COLUMN_RULES,
+        'dedupe': True,
+    },
+    'dme_orders': {
+        'layout': 'table',
+        'columns': ECW_COLUMN_RULES,
+        'dedupe': True,
+    },
+    'daily_abandoned_calls': {
+        'layout': 'table',
+        'columns': [
+            (r'(?i)\bdate\b', 'datetime'),
+            (r'(?i)\b(calls|count|position)\b', 'int'),
+            (r'(?i)\b(seconds|secs)\b', 'float'),
+        ],
+        'dedupe': False,
+    },
+}
+
+# ===========================
+# Transform Engine
+# ===========================
+
+def read_report(path, encoding=None, delimiter=None):
+    """Read a downloaded report with every cell as a string, so typing happens in one place."""
+    return read_table(path, encoding=encoding, delimiter=delimiter)
+
+def rows_report(rows):
+    """Build the same all-string DataFrame as read_report from captured rows (header first)."""
+    header, *body = rows
+    return pd.DataFrame([['' if value is None else str(value) for value in row] for row in body], columns=header, dtype=str)
+
+def transform_report(df, report):
+    """Apply the report's spec to a raw DataFrame and return the typed, cleaned result."""
+    spec = REPORT_SPECS[report]
+    if spec['layout'] == 'summary':
+        return _transform_summary(df, spec)
+    return _transform_table(df, spec)
+
+def _convert(column, dtype):
+    """Convert a string column; return None when any non-blank value does not parse."""
+    blank = column.eq('')
+    if dtype == 'datetime':
+        converted = pd.to_datetime(column.where(~blank), errors='coerce')
+    elif dtype in ('float', 'int'):
+        converted = pd.to_numeric(column.where(~blank).str.replace(r'[$,\s]', '', regex=True), errors='coerce')
+        if dtype == 'int':
+            if not (converted.dropna() % 1 == 0).all():
+                return None
+            converted = converted.astype('Int64')
+    else:
+        return column
+
+    if (converted.isna() & ~blank).any():
+        return None
+    return converted
+
+def _transform_table(df, spec):
+    """Strip, drop blank rows, type the columns matched by the spec and optionally dedupe."""
+    # Work by position so repeated header names (e.g. two "Date" columns) don't collide
+    names = [str(name).strip() for name in df.columns]
+    df = df.set_axis(range(len(names)), axis=1).apply(lambda column: column.str.strip())
+    df = df[df.ne('').any(axis=1)]
+    if spec.get('dedupe'):
+        df = df.drop_duplicates()
+
+    for position, name in enumerate(names):
+        dtype = next((dtype for pattern, dtype in spec.get('columns', []) if re.search(pattern, name)), None)
+        if dtype is None:
+            continue
+        column = _convert(df[position], dtype)
+        if column is None:
+            logging.warning(f"Column '{name}' does not parse as {dtype}; keeping it as text")
+        else:
+            df[position] = column
+
+    return df.set_axis(names, axis=1).reset_index(drop=True)
+
+def _transform_summary(df, spec):
+    """Extract transaction totals and per-section summaries from a fixed-layout summary report."""
+    totals_text = df.iat[0, 0]
+    if not isinstance(totals_text, str):
+        logging.error(f"Error parsing transaction totals: unexpected value {totals_text!r}")
+        return None
+    totals = dict(re.findall(r'(\w+): (\d+)', totals_text))
+
+    start, end = spec['rows']
+    positions = [position for position, _ in spec['sections'].values()]
+    summary = df.iloc[start:end, positions].fillna('').reset_index(drop=True)
+    summary.columns = list(spec['sections'])
+    summary.insert(0, 'Transaction Totals:', [f"{label}: {totals.get(key, '0')}" for label, key in spec['cards']])
+
+    # Each totals cell reads "<label>: <value>"
+    total_values = df.iloc[spec['totals_row'], positions].astype(str).str.split(': ', n=1).str[1].tolist()
+    labels = [label for _, label in spec['sections'].values()]
+    first_total = f"{labels[0]}: {total_values[0]}"
+    summary.loc[len(summary)] = [first_total] + [f"{label}: {value}" for label, value in zip(labels, total_values)]
+    return summary
+
+def dataframe_rows(df):
+    """Yield the header and rows of a typed DataFrame as Sheets values: numbers stay numbers, dates become ISO text."""
+    names = [str(name) for name in df.columns]
+    df = df.set_axis(range(len(names)), axis=1)
+    for position in df.columns:
+        column = df[position]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            has_time = (column.dropna().dt.normalize() != column.dropna()).any()
+            df[position] = column.dt.strftime('%Y-%m-%d %H:%M:%S' if has_time else '%Y-%m-%d')
+    yield names
+    yield from df.astype(object).where(df.notna(), '').values.tolist()
@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import resource
+import multiprocessing
+import logging
+import helper
+from helper import close_browser_pool, init, reset_retry_budget
+from jobs import run_job, job_catalog, log_job_summary, SYSTEM_CONCURRENCY
+
+
+# ===========================
+# Job Queue
+# ===========================
+
+# A local SQLite queue of job names shared by the supervisor and its worker processes.
+def queue_path():
+    """Path of the queue database, under helper.config_dir."""
+    return os.path.join(helper.config_dir, 'job_queue.sqlite3')
+
+# Per-portal limits applied when a worker claims a job: at most `max_running` jobs of a
+# portal at once, and at least `min_interval` seconds between two job starts on it.
+PORTAL_RATE_LIMITS = {
+    'ECW': {
+        'max_running': SYSTEM_CONCURRENCY['ECW'],
+        'min_interval': float(os.getenv('ECW_MIN_INTERVAL', '5')),
+    },
+    'COMTEC': {
+        'max_running': SYSTEM_CONCURRENCY['COMTEC'],
+        'min_interval': float(os.getenv('COMTEC_MIN_INTERVAL', '5')),
+    },
+}
+WORKER_COUNT = int(os.getenv('WORKERS', '2'))
+RECYCLE_AFTER_JOBS = int(os.getenv('RECYCLE_AFTER_JOBS', '20'))
+RECYCLE_RSS_MB = int(os.getenv('RECYCLE_RSS_MB', '1500'))
+POLL_INTERVAL = float(os.getenv('QUEUE_POLL_INTERVAL', '2'))
+
+
+def connect_queue():
+    """Open the queue database, creating it on first use."""
+    connection = sqlite3.connect(queue_path(), timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            system TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            enqueued_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            worker TEXT,
+            result TEXT
+        )
+    ''')
+    connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, system)')
+    return connection
+
+
+def enqueue_jobs(names=None):
+    """
+    Queue jobs by name (default: every job in the catalog).
+    A job that is already queued or running is not queued twice.
+    Returns:
+        list of the names that were queued
+    """
+    catalog = job_catalog()
+    names = names or list(catalog)
+    queued = []
+    connection = connect_queue()
+    try:
+        for name in names:
+            if name not in catalog:
+                raise ValueError(f"Unknown job '{name}'")
+            pending = connection.execute(
+                "SELECT 1 FROM jobs WHERE name = ? AND status IN ('queued', 'running')", (name,)
+            ).fetchone()
+            if pending:
+                logging.info(f"Job '{name}' is already queued")
+                continue
+            connection.execute(
+                'INSERT INTO jobs (name, system, enqueued_at) VALUES (?, ?, ?)',
+                (name, catalog[name]['system'], time.time())
+            )
+            queued.append(name)
+    finally:
+        connection.close()
+    logging.info(f"Queued {len(queued)} job(s): {', '.join(queued) or 'none'}")
+    return queued
+
+
+def claim_job(connection, worker):
+    """Atomically take the oldest queued job whose portal is under its rate limits, or return None."""
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        for job in connection.execute("SELECT id, name, system FROM jobs WHERE status = 'queued' ORDER BY id").fetchall():
+            limits = PORTAL_RATE_LIMITS.get(job['system'], {'max_running': 1, 'min_interval': 0})
+            running, last_start = connection.execute(
+                "SELECT SUM(status = 'running'), MAX(started_at) FROM jobs WHERE system = ?", (job['system'],)
+            ).fetchone()
+            if (running or 0) >= limits['max_running'] or now - (last_start or 0) < limits['min_interval']:
+                continue
+            connection.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, worker = ? WHERE id = ?",
+                (now, worker, job['id'])
+            )
+            connection.execute('COMMIT')
+            return job
+        connection.execute('COMMIT')
+        return None
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+
+
+def finish_job(connection, job_id, result):
+    """Record a job's result (see run_job)."""
+    connection.execute(
+        'UPDATE jobs SET status = ?, finished_at = ?, result = ? WHERE id = ?',
+        ('done' if result['status'] == 'ok' else 'failed', time.time(), json.dumps(result), job_id)
+    )
+
+
+def requeue_orphans(connection, live_workers):
+    """Put jobs claimed by workers that are no longer alive back in the queue."""
+    placeholders = ','.join('?' * len(live_workers)) or "''"
+    count = connection.execute(
+        f"UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL "
+        f"WHERE status = 'running' AND worker NOT IN ({placeholders})",
+        list(live_workers)
+    ).rowcount
+    if count:
+        logging.warning(f"Re-queued {count} job(s) left running by a stopped worker")
+
+
+def queue_counts(connection):
+    """Number of jobs per status."""
+    return dict(connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+
+# ===========================
+# Workers
+# ===========================
+
+def process_tree_rss_mb(pid=None):
+    """Resident memory of a process and all its descendants (the Playwright driver and Chrome), in MB."""
+    pid = pid or os.getpid()
+    if not os.path.isdir('/proc'):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status') as status_file:
+                fields = dict(line.split(':', 1) for line in status_file if ':' in line)
+        except OSError:
+            continue  # exited while we were looking
+        children.setdefault(int(fields['PPid'].strip()), []).append(int(entry))
+        rss[int(entry)] = int(fields.get('VmRSS', '0 kB').split()[0])
+
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total / 1024
+
+
+def run_worker(worker, stop, drain=False):
+    """
+    Pull jobs from the queue until `stop` is set (or, with `drain`, until no work is left).
+    The browser stays warm between jobs and is recycled after RECYCLE_AFTER_JOBS jobs or
+    once the worker's process tree grows past RECYCLE_RSS_MB.
+    """
+    catalog = job_catalog()
+    connection = connect_queue()
+    handled = 0
+    logging.info(f"Worker {worker} started (pid {os.getpid()})")
+    try:
+        while not stop.is_set():
+            job = claim_job(connection, worker)
+            if job is None:
+                counts = queue_counts(connection)
+                if drain and not counts.get('queued') and not counts.get('running'):
+                    break
+                stop.wait(POLL_INTERVAL)
+                continue
+
+            # Each queued job is its own run, so it gets the full retry budget
+            reset_retry_budget()
+            result = run_job(catalog[job['name']])
+            finish_job(connection, job['id'], result)
+            handled += 1
+
+            rss_mb = process_tree_rss_mb()
+            if handled >= RECYCLE_AFTER_JOBS or rss_mb > RECYCLE_RSS_MB:
+                logging.info(f"Worker {worker} recycling its browser after {handled} job(s) at {rss_mb:.0f} MB")
+                close_browser_pool()
+                handled = 0
+    finally:
+        close_browser_pool()
+        connection.close()
+        logging.info(f"Worker {worker} stopped")
+
+
+def _worker_main(worker, stop, drain):
+    """Process entry point of a worker."""
+    init()
+    try:
+        run_worker(worker, stop, drain)
+    except KeyboardInterrupt:
+        pass
+
+
+# ===========================
+# Supervisor
+# ===========================
+
+def run_supervisor(workers=None, drain=False):
+    """
+    Run `workers` worker processes against the queue, restarting any that crash.
+    With `drain`, return once the queue is empty; otherwise run until interrupted.
+    Returns:
+        list of results of the jobs finished while the supervisor ran
+    """
+    workers = workers or WORKER_COUNT
+    started = time.time()
+    spawn = multiprocessing.get_context('spawn')  # Playwright must not be inherited through fork
+    stop = spawn.Event()
+    processes = {}
+
+    def start_worker(index):
+        name = f"worker-{index}"
+        process = spawn.Process(target=_worker_main, args=(name, stop, drain), name=name, daemon=False)
+        process.start()
+        processes[index] = process
+
+    connection = connect_queue()
+    try:
+        requeue_orphans(connection, [])
+        for index in range(workers):
+            start_worker(index)
+
+        while processes:
+            time.sleep(POLL_INTERVAL)
+            for index, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                del processes[index]
+                if process.exitcode != 0 and not stop.is_set():
+                    logging.warning(f"Worker {process.name} exited with code {process.exitcode}, restarting it")
+                    requeue_orphans(connection, [p.name for p in processes.values()])
+                    start_worker(index)
+    except KeyboardInterrupt:
+        logging.info("Stopping workers after their current job")
+    finally:
+        stop.set()
+        for process in processes.values():
+            process.join()
+        rows = connection.execute(
+            "SELECT result FROM jobs WHERE finished_at >= ? AND result IS NOT NULL ORDER BY finished_at", (started,)
+        ).fetchall()
+        connection.close()
+
+    results = [json.loads(row['result']) for row in rows]
+    log_job_summary(results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local job queue and worker fleet for the report jobs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    enqueue = commands.add_parser('enqueue', help='Queue jobs by name (default: all)')
+    enqueue.add_argument('names', nargs='*')
+    run = commands.add_parser('run', help='Start the supervisor and its workers')
+    run.add_argument('--workers', type=int, default=WORKER_COUNT)
+    run.add_argument('--drain', action='store_true', help='Exit once the queue is empty')
+    commands.add_parser('status', help='Show queue counts by status')
+    args = parser.parse_args()
+
+    init()
+    if args.command == 'enqueue':
+        enqueue_jobs(args.names)
+    elif args.command == 'run':
+        run_supervisor(args.workers, drain=args.drain)
+    else:
+        connection = connect_queue()
+        try:
+            for status, count in sorted(queue_counts(connection).items()):
+                print(f"{status}: {count}")
+        finally:
+            connection.close()
+
+if __name__ == "__main__":
+    main()